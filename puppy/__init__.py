@@ -1,3 +1,7 @@
+from .async_browser import AsyncBrowser
 from .browser import Browser
+from .browser_pool import BrowserPool
+from .response_cache import ResponseCache
+from .url_matcher import UrlMatcher
 
-__all__ = ['Browser']
+__all__ = ['AsyncBrowser', 'Browser', 'BrowserPool', 'ResponseCache', 'UrlMatcher']
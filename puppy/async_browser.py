@@ -0,0 +1,134 @@
+import asyncio
+import shutil
+import tempfile
+
+from .async_connection import AsyncConnection
+from .async_page import AsyncPage
+from .browser import DEVTOOLS_LISTENING_RE, build_command
+from .exceptions import BrowserError
+
+
+class AsyncBrowser:
+    '''The asyncio counterpart to `Browser`. Every page shares one connection read by a single task:
+
+       ```
+       browser = await AsyncBrowser.launch()
+       pages = [await browser.new_page() for _ in range(100)]
+       await asyncio.gather(*[page.goto(url) for page, url in zip(pages, urls)])
+       await browser.close()
+       ```
+    '''
+
+    def __init__(self, proxy_uri=None, debug=False):
+        self._proxy_uri = proxy_uri
+        self._debug = debug
+        self._tmp_user_data_dir = None
+        self._pages = []
+        self.process = None
+        self.connection = None
+        self.websocket_endpoint = None
+        self.page = None
+        self._output_drainer = None
+
+    @classmethod
+    async def launch(cls,
+                     headless=True,
+                     proxy_uri=None,
+                     user_agent=None,
+                     user_data_dir=None,
+                     executable_path=None,
+                     debug=False,
+                     args=None):
+        browser = cls(proxy_uri=proxy_uri, debug=debug)
+        if user_data_dir is None:
+            browser._tmp_user_data_dir = tempfile.mkdtemp(dir='/tmp')
+        cmd = build_command(executable_path,
+                            0,
+                            headless=headless,
+                            proxy_uri=proxy_uri,
+                            user_agent=user_agent,
+                            user_data_dir=user_data_dir or browser._tmp_user_data_dir,
+                            args=args)
+
+        try:
+            browser.process = await asyncio.create_subprocess_exec(*cmd,
+                                                                   stdout=asyncio.subprocess.PIPE,
+                                                                   stderr=asyncio.subprocess.STDOUT)
+            browser.websocket_endpoint = await browser._wait_for_ws_endpoint()
+            browser.connection = await AsyncConnection.connect(browser.websocket_endpoint, debug=debug)
+
+            response = await browser.connection.send('Target.getTargets')
+            targets = [t for t in response['targetInfos'] if t['type'] == 'page']
+            for target in targets:
+                browser._pages.append(await AsyncPage.create(browser.connection, target['targetId'], proxy_uri=proxy_uri))
+            if browser._pages:
+                browser.page = browser._pages[0]
+            else:
+                browser.page = await browser.new_page()
+        except BaseException:
+            await browser._abort_launch()
+            raise
+        return browser
+
+    async def new_page(self, url='about:blank'):
+        response = await self.connection.send('Target.createTarget', url=url)
+        page = await AsyncPage.create(self.connection, response['targetId'], proxy_uri=self._proxy_uri)
+        self._pages.append(page)
+        return page
+
+    async def _wait_for_ws_endpoint(self, timeout=5):
+        try:
+            endpoint = await asyncio.wait_for(self._read_ws_endpoint(), timeout)
+        except asyncio.TimeoutError:
+            raise BrowserError('Timed out waiting for Chrome to open')
+        # Keep reading Chrome's output so it never blocks on a full pipe
+        self._output_drainer = asyncio.ensure_future(self._drain_output())
+        return endpoint
+
+    async def _read_ws_endpoint(self):
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                raise BrowserError('Chrome exited before opening its devtools server')
+            match = DEVTOOLS_LISTENING_RE.match(line.decode('utf-8', 'replace'))
+            if match:
+                return match.group(1)
+
+    async def _drain_output(self):
+        while await self.process.stdout.read(65536):
+            pass
+
+    async def _abort_launch(self):
+        # Undo a launch that failed partway: nothing else holds on to the process or the profile
+        if self.connection is not None:
+            await self.connection.close()
+        if self.process is not None and self.process.returncode is None:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+            await self.process.wait()
+        if self._output_drainer is not None:
+            self._output_drainer.cancel()
+        if self._tmp_user_data_dir is not None:
+            shutil.rmtree(self._tmp_user_data_dir, ignore_errors=True)
+
+    async def close(self):
+        try:
+            await self.connection.send('Browser.close')
+        finally:
+            await self.connection.close()
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                raise BrowserError('Timeout waiting for Chrome to close')
+            finally:
+                if self._tmp_user_data_dir is not None:
+                    shutil.rmtree(self._tmp_user_data_dir, ignore_errors=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
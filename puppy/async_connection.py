@@ -0,0 +1,143 @@
+import asyncio
+
+import websockets
+
+from .async_session import AsyncSession, dispatch_event
+from .codec import get_codec
+from .exceptions import BrowserError
+from .session import Subscription
+
+
+MESSAGE_TIMEOUT = 300
+
+
+class AsyncConnection:
+    '''An asyncio counterpart to `Connection`.
+
+    A single task reads the websocket and resolves the futures of pending commands, so any number of
+    sessions can share one connection without a thread per session. Sessions are attached in flat mode,
+    meaning their messages carry a top-level `sessionId` and are routed straight to the right session.
+    '''
+
+    def __init__(self, endpoint, debug=False, codec=None):
+        self.endpoint = endpoint
+        self.closed = False
+        self.codec = get_codec(codec)
+
+        self.messages = {}
+        self._sessions = {}
+        self.event_handlers = {}
+
+        self._ws = None
+        self._recv_task = None
+        self._message_id = 0
+        self._debug = debug
+
+    @classmethod
+    async def connect(cls, endpoint, debug=False, codec=None):
+        connection = cls(endpoint, debug=debug, codec=codec)
+        connection._ws = await websockets.connect(endpoint, max_size=None)
+        connection._recv_task = asyncio.ensure_future(connection._recv_loop())
+        return connection
+
+    async def new_session(self, target_id):
+        response = await self.send('Target.attachToTarget', targetId=target_id, flatten=True)
+        session_id = response['sessionId']
+        session = AsyncSession(self, session_id)
+        self._sessions[session_id] = session
+        return session
+
+    async def _recv_loop(self):
+        try:
+            async for message_raw in self._ws:
+                if self._debug:  # TODO: set up a logger and format this nicely
+                    print('recieved -- ', message_raw[:1000])
+                self._on_message(self.codec.loads(message_raw))
+        except websockets.ConnectionClosed:
+            if not self.closed:
+                raise
+        finally:
+            self._cancel_pending(BrowserError('Connection to browser closed'))
+
+    def _on_message(self, message):
+        session_id = message.get('sessionId')
+        if session_id is not None:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.on_message(message)
+            return
+
+        # Responses to messages sent from this connection
+        if 'id' in message:
+            future = self.messages.pop(message['id'], None)
+            if future is None or future.done():
+                return
+            if 'error' in message:
+                future.set_exception(BrowserError(message['error']))
+            else:
+                future.set_result(message.get('result'))
+
+        # Events fired for this connection
+        elif 'method' in message:
+            if message['method'] == 'Target.detachedFromTarget':
+                session = self._sessions.pop(message['params'].get('sessionId'), None)
+                if session is not None:
+                    session.close()
+            dispatch_event(self.event_handlers, message)
+
+    def _cancel_pending(self, exc):
+        for future in self.messages.values():
+            if not future.done():
+                future.set_exception(exc)
+        self.messages.clear()
+        for session in list(self._sessions.values()):
+            session.close()
+
+    async def send(self, method, _timeout=None, **kwargs):
+        message = {'method': method, 'params': kwargs}
+        return await self._send(message, timeout=_timeout)
+
+    async def _send(self, message, session=None, timeout=None):
+        '''Write a message and wait for its reply. Messages meant for a session are tagged with its id and
+        tracked by that session, which shares this connection's id counter.'''
+        if self.closed:
+            raise BrowserError('Connection to browser closed')
+        message['id'] = self.message_id()
+        future = asyncio.get_event_loop().create_future()
+        pending = self.messages if session is None else session.messages
+        pending[message['id']] = future
+        if session is not None:
+            message['sessionId'] = session.session_id
+        message_raw = self.codec.dumps(message)
+        if self._debug:  # TODO: set up a logger and format this nicely
+            print('sent -- ', message_raw)
+        try:
+            await self._ws.send(message_raw)
+            return await asyncio.wait_for(future, timeout=MESSAGE_TIMEOUT if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            raise BrowserError('Timed out waiting for response from browser')
+        finally:
+            pending.pop(message['id'], None)
+
+    def on(self, method, cb):
+        self.event_handlers[method] = self.event_handlers.get(method, [])
+        self.event_handlers[method].append(cb)
+        return Subscription(self, method, cb)
+
+    def off(self, method, cb):
+        handlers = self.event_handlers.get(method, [])
+        if cb in handlers:
+            handlers.remove(cb)
+
+    def message_id(self):
+        id_ = self._message_id
+        self._message_id += 1
+        return id_
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        await self._ws.close()
+        if self._recv_task is not None:
+            await asyncio.wait([self._recv_task])
@@ -0,0 +1,128 @@
+import asyncio
+
+from .exceptions import BrowserError, PageError
+from .js_object import ElementList, JSObject, MAP_FUNCTION, QUERY_SELECTOR_ALL_FUNCTION, XPATH_FUNCTION
+
+
+class AsyncJSObject(JSObject):
+    '''The asyncio counterpart to `JSObject`; every remote call is a coroutine'''
+
+    def __init__(self, object_id, description, page, context_id=None):
+        self._object_id = object_id
+        self._description = description
+        self._page = page
+        self._context_id = context_id
+
+    async def release(self):
+        await self._page.session.send('Runtime.releaseObject', objectId=self._object_id)
+
+    async def _method(self, method, *args):
+        function = f'(element, ...args) => element.{method}(...args)'
+        args = [self, *args]
+        return await self._remote_call(function, args)
+
+    async def _prop(self, prop):
+        function = f'(element) => element.{prop}'
+        args = [self]
+        return await self._remote_call(function, args)
+
+    async def _remote_call(self, function, args):
+        args = self._convert_args(args)
+        response = await self._page.session.send(
+            'Runtime.callFunctionOn',
+            functionDeclaration=function,
+            arguments=args,
+            objectId=self._object_id
+        )
+        if 'exceptionDetails' in response:
+            raise PageError('Remote javascript call failed: %s' % response['exceptionDetails'])
+
+        return self._wrap_remote_object(response['result'])
+
+    def _wrap_remote_object(self, remote_object):
+        if 'value' in remote_object:
+            return remote_object['value']
+        elif remote_object['type'] == 'object':
+            if remote_object.get('subtype') == 'node':
+                return AsyncElement(remote_object['objectId'], remote_object['description'], self._page)
+            else:
+                return AsyncJSObject(remote_object['objectId'], remote_object['description'], self._page)
+        elif remote_object['type'] == 'undefined':
+            return None
+        else:
+            raise BrowserError('Unknown response from remote javascipt call')
+
+    async def _items(self):
+        response = await self._page.session.send('Runtime.getProperties', objectId=self._object_id, ownProperties=True)
+        asyncio.ensure_future(self.release())
+        items = [p for p in response['result'] if p['name'].isdigit() and 'value' in p]
+        items.sort(key=lambda p: int(p['name']))
+        return [self._wrap_remote_object(p['value']) for p in items]
+
+
+class AsyncElement(AsyncJSObject):
+    '''The asyncio counterpart to `Element`. Properties such as `text` and `html` return awaitables.'''
+
+    async def xpath(self, expression):
+        return AsyncElementList(await (await self._remote_call(XPATH_FUNCTION, [self, expression]))._items(), self._page)
+
+    async def querySelector(self, selector):
+        return await self._method('querySelector', selector)
+
+    async def querySelectorAll(self, selector):
+        return AsyncElementList(await (await self._remote_call(QUERY_SELECTOR_ALL_FUNCTION, [self, selector]))._items(), self._page)
+
+    @property
+    def html(self):
+        return self._prop('outerHTML')
+
+    @property
+    def text(self):
+        return self._prop('textContent')
+
+    async def focus(self):
+        return await self._method('focus')
+
+    async def click(self):
+        quads = (await self._page.session.send('DOM.getContentQuads', objectId=self._object_id))['quads'][0]
+        mean_x = sum([quads[i] for i in range(0, len(quads), 2)]) / (len(quads) / 2)
+        mean_y = sum([quads[i] for i in range(1, len(quads), 2)]) / (len(quads) / 2)
+        await self._page.session.send('Input.dispatchMouseEvent', type='mouseMoved', x=mean_x, y=mean_y)
+        await self._page.session.send('Input.dispatchMouseEvent', type='mousePressed', x=mean_x, y=mean_y, button='left', clickCount=1)
+        await self._page.session.send('Input.dispatchMouseEvent', type='mouseReleased', x=mean_x, y=mean_y, button='left', clickCount=1)
+
+    @property
+    def is_visible(self):
+        return self._is_visible()
+
+    async def _is_visible(self):
+        style = await self._remote_call('window.getComputedStyle', [self])
+        visibility = await style._prop('visibility')
+        has_visible_bounding_box = await self._remote_call(
+            '''
+            (element) => {
+                const rect = element.getBoundingClientRect();
+                return !!(rect.top || rect.bottom || rect.width || rect.height);
+            }
+            ''',
+            [self]
+        )
+        return visibility != 'hidden' and has_visible_bounding_box
+
+
+class AsyncElementList(ElementList):
+    '''The asyncio counterpart to `ElementList`; its bulk accessors return awaitables'''
+
+    async def map_js(self, function, *args):
+        if not self:
+            return []
+        response = await self._page.session.send(
+            'Runtime.callFunctionOn',
+            functionDeclaration=MAP_FUNCTION.format(function=function),
+            arguments=[{'value': len(args)}] + [{'value': arg} for arg in args] + [{'objectId': e._object_id} for e in self],
+            objectId=self[0]._object_id,
+            returnByValue=True
+        )
+        if 'exceptionDetails' in response:
+            raise PageError('Mapping `%s` over the elements failed: %s' % (function, response['exceptionDetails']))
+        return response['result']['value']
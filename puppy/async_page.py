@@ -0,0 +1,287 @@
+import asyncio
+import json
+
+from .async_js_object import AsyncElement, AsyncElementList, AsyncJSObject
+from .exceptions import BrowserError, PageError
+from .extract import extract_expression
+from .js_object import QUERY_SELECTOR_ALL_FUNCTION, WAIT_FOR_FUNCTION, XPATH_FUNCTION
+from .request import Request
+from .request_manager import AsyncRequestManager
+from .response import AsyncResponse
+
+
+class AsyncLifecycleWatcher:
+    '''Waits for lifecycle events on the page's own session, unsubscribing once done'''
+
+    def __init__(self, page, wait_until, require_new_loader=True):
+        self._page = page
+        self._wait_until = wait_until if isinstance(wait_until, list) else [wait_until]
+        self._require_new_loader = require_new_loader
+        self._initial_loader_id = page.loader_id
+        self._lifecycle_events = set()
+        self._lifecycle_complete_event = asyncio.Event()
+        self._page.session.on('Page.lifecycleEvent', self._on_lifecycle_event)
+
+    def _on_lifecycle_event(self, loaderId, name, **kwargs):
+        if name == 'init':
+            self._lifecycle_events.clear()
+            return
+        if not self._require_new_loader or loaderId != self._initial_loader_id:
+            self._lifecycle_events.add(name)
+        if all(event in self._lifecycle_events for event in self._wait_until):
+            self._lifecycle_complete_event.set()
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._lifecycle_complete_event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise PageError('Navigation not completed after %s seconds.' % timeout)
+        finally:
+            self.cancel()
+
+    def cancel(self):
+        self._page.session.off('Page.lifecycleEvent', self._on_lifecycle_event)
+
+
+class AsyncPage:
+    '''The asyncio counterpart to `Page`. Create one with `await AsyncPage.create(...)` or
+    through `AsyncBrowser.new_page()`.'''
+
+    def __init__(self, connection, target_id, proxy_uri=None):
+        self._proxy_uri = proxy_uri
+        self._target_id = target_id
+        self._connection = connection
+        self._request_manager = AsyncRequestManager(self, self._proxy_uri)
+
+        self.closed = False
+
+        self._requests_by_url = {}
+        self._requests_by_id = {}
+
+        self._loader_id = None
+        self._frame_id = None
+        self._navigation_url = None
+
+        self.session = None
+
+    @classmethod
+    async def create(cls, connection, target_id, proxy_uri=None):
+        page = cls(connection, target_id, proxy_uri=proxy_uri)
+        page.session = await page.create_devtools_session()
+
+        page.session.on('Network.requestWillBeSent', page._on_request_will_be_sent)
+        page.session.on('Network.responseReceived', page._on_response_recieved)
+        page.session.on('Page.lifecycleEvent', page._on_lifecycle_event)
+        page.session.on('Page.frameNavigated', page._on_frame_navigated)
+
+        await asyncio.gather(
+            page.session.send('Network.enable', enabled=True),
+            page.session.send('Page.enable', enabled=True),
+            page.session.send('Page.setLifecycleEventsEnabled', enabled=True),
+            page._request_manager.enable(),
+        )
+        return page
+
+    # Public API #
+
+    async def click(self, xpath_expression):
+        """Click an element on the page. See `Page.click`."""
+        element_list = await self.xpath(xpath_expression)
+        if not len(element_list):
+            raise PageError('Element with xpath %s does not exist' % xpath_expression)
+        await element_list[0].click()
+
+    async def close(self):
+        """Close the page."""
+        if self.closed:
+            return
+        self.closed = True
+        response = await self._connection.send('Target.closeTarget', targetId=self._target_id)
+        if not response['success']:
+            raise BrowserError('Could not close page')
+
+    async def content(self):
+        """Get the page's rendered HTML content."""
+        document = await self.document
+        return await (await document._prop('documentElement')).html
+
+    async def create_devtools_session(self):
+        """Create a new session to send messages to the running Chrome devtools server."""
+        return await self._connection.new_session(self._target_id)
+
+    @property
+    def document(self):
+        """An awaitable resolving to an Element representing the current page's `document` object."""
+        return self._document()
+
+    async def _document(self):
+        response = await self.evaluate('document')
+        return AsyncElement(response['objectId'], response['description'], self)
+
+    async def evaluate(self, expression):
+        """Send an expression to be evaluated in the browser's JavaScript console. See `Page.evaluate`."""
+        response = await self.session.send('Runtime.evaluate', expression=expression)
+        if 'value' in response['result']:
+            return response['result']['value']
+        else:
+            return response['result']
+
+    async def evaluate_on_new_document(self, script):
+        """Set a script to be evaluated on each new page visit."""
+        await self.session.send('Page.addScriptToEvaluateOnNewDocument', source=script)
+
+    async def goto(self,
+                   url,
+                   timeout=30,
+                   wait_until='load'):
+        """Visit a url. See `Page.goto`."""
+        lifecyle_watcher = AsyncLifecycleWatcher(self, wait_until)
+        await self.session.send('Page.navigate', url=url)
+        await lifecyle_watcher.wait(timeout)
+        if self._navigation_url in self._requests_by_url:
+            return self._requests_by_url[self._navigation_url].response
+
+    async def extract(self, schema):
+        """Extract structured data from the page with a single round trip. See `Page.extract`."""
+        response = await self.session.send('Runtime.evaluate', expression=extract_expression(schema), returnByValue=True)
+        if 'exceptionDetails' in response:
+            raise PageError('Extraction failed: %s' % response['exceptionDetails'])
+        return response['result']['value']
+
+    async def focus(self, xpath_expression):
+        """Focus an element on the page. See `Page.focus`."""
+        element_list = await self.xpath(xpath_expression)
+        if not len(element_list):
+            raise PageError('Element with xpath %s does not exist' % xpath_expression)
+        await element_list[0].focus()
+
+    async def reload(self):
+        """Refresh the page."""
+        async with self.wait_for_navigation(wait_until='load'):
+            await self.session.send('Page.reload')
+
+    @property
+    def requests(self):
+        """All the requests this page has made."""
+        return list(self._requests_by_url.values())
+
+    async def select(self, selector):
+        """Search the current page for elements matching a CSS selector."""
+        return await self._evaluate_items(QUERY_SELECTOR_ALL_FUNCTION, selector)
+
+    async def type(self, xpath_expression, text, delay=0):
+        """Give an element focus, then simulate a series of keyboard events. See `Page.type`."""
+        await self.focus(xpath_expression)
+        for char in text:
+            await asyncio.sleep(delay)
+            await self.session.send('Input.dispatchKeyEvent', type='char', text=char)
+
+    async def url(self):
+        """Return the URL of the current page."""
+        response = await self.session.send('Target.getTargetInfo', targetId=self._target_id)
+        return response.get('targetInfo', {}).get('url')
+
+    def wait_for_navigation(self, wait_until='load', timeout=30):
+        """An async context manager used to run a command and wait for the navigation it triggers:
+
+           ```
+           async with page.wait_for_navigation():
+               await page.click('*//a[@id="nav-link"]')
+           ```
+        """
+        return _NavigationContext(self, wait_until, timeout)
+
+    async def wait_for_selector(self, selector, visible=False, timeout=30):
+        """Wait until an element matching a CSS selector is present on the page. See `Page.wait_for_selector`."""
+        return await self._wait_for('selector', selector, visible, timeout)
+
+    async def wait_for_xpath(self, xpath_expr, visible=False, timeout=30):
+        """Wait until an element is present on the page. See `Page.wait_for_xpath`."""
+        return await self._wait_for('xpath', xpath_expr, visible, timeout)
+
+    async def xpath(self, expression):
+        """Search the current page for elements matching an xpath expression."""
+        return await self._evaluate_items(XPATH_FUNCTION, expression)
+
+    async def blacklist_url_patterns(self, *args):
+        await self._request_manager.blacklist_url_patterns(*args)
+
+    async def blacklist_url_rules(self, *rules):
+        await self._request_manager.blacklist_url_rules(*rules)
+
+    async def load_url_blacklist(self, path):
+        await self._request_manager.load_url_blacklist(path)
+
+    async def set_url_blacklist(self, url_matcher):
+        await self._request_manager.set_url_matcher(url_matcher)
+
+    def interception_stats(self):
+        return self._request_manager.stats()
+
+    @property
+    def url_blacklist(self):
+        return self._request_manager.url_matcher
+
+    async def blacklist_resource_types(self, *args):
+        await self._request_manager.blacklist_resource_types(*args)
+
+    # Private methods
+    async def _wait_for(self, kind, selector, visible, timeout):
+        expression = '({})({}, {}, {}, {})'.format(
+            WAIT_FOR_FUNCTION, json.dumps(kind), json.dumps(selector), json.dumps(visible), int(timeout * 1000)
+        )
+        response = await self.session.send('Runtime.evaluate', _timeout=timeout + 5, expression=expression, awaitPromise=True)
+        if 'exceptionDetails' in response:
+            raise PageError('Waiting for `%s` failed: %s' % (selector, response['exceptionDetails']))
+        result = response['result']
+        if result.get('subtype') == 'null':
+            raise PageError('Timed out waiting for element at `%s`' % selector)
+        return AsyncElementList(await AsyncJSObject(result['objectId'], result['description'], self)._items(), self)
+
+    async def _evaluate_items(self, function, argument):
+        response = await self.session.send('Runtime.evaluate', expression='({})(document, {})'.format(function, json.dumps(argument)))
+        if 'exceptionDetails' in response:
+            raise PageError('Evaluating `%s` failed: %s' % (argument, response['exceptionDetails']))
+        result = response['result']
+        return AsyncElementList(await AsyncJSObject(result['objectId'], result['description'], self)._items(), self)
+
+    def _on_request_will_be_sent(self, **kwargs):
+        request = Request(kwargs['request'], kwargs['requestId'])
+        self._requests_by_id[request.request_id] = request
+        self._requests_by_url[request.url] = request
+
+    def _on_response_recieved(self, **kwargs):
+        request = self._requests_by_id.get(kwargs['requestId'])
+        if request is not None:
+            request.set_response(AsyncResponse(kwargs['response'], request, self))
+
+    @property
+    def loader_id(self):
+        return self._loader_id
+
+    def _on_lifecycle_event(self, **kwargs):
+        if kwargs['name'] == 'init':
+            self._loader_id = kwargs['loaderId']
+
+    def _on_frame_navigated(self, **kwargs):
+        is_main_frame = not bool(kwargs['frame'].get('parentId'))
+        if is_main_frame:
+            self._frame_id = kwargs['frame']['id']
+            self._navigation_url = kwargs['frame']['url']
+
+
+class _NavigationContext:
+    def __init__(self, page, wait_until, timeout):
+        self._page = page
+        self._wait_until = wait_until
+        self._timeout = timeout
+        self._lifecycle_watcher = None
+
+    async def __aenter__(self):
+        self._lifecycle_watcher = AsyncLifecycleWatcher(self._page, self._wait_until, False)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self._lifecycle_watcher.wait(self._timeout)
+        else:
+            self._lifecycle_watcher.cancel()
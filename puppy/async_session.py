@@ -0,0 +1,75 @@
+import asyncio
+import traceback
+
+from .exceptions import BrowserError
+from .session import Subscription
+
+
+def dispatch_event(event_handlers, event):
+    '''Run the handlers registered for an event. Handlers may be plain callables or coroutine functions;
+    coroutines are scheduled on the running loop so a slow handler never stalls the websocket reader.
+    A handler that raises is reported and doesn't affect the others, nor the reader.'''
+    for cb in list(event_handlers.get(event['method'], ())):
+        try:
+            result = cb(**event.get('params', {}))
+        except Exception:
+            traceback.print_exc()
+            continue
+        if asyncio.iscoroutine(result):
+            asyncio.ensure_future(result).add_done_callback(_report_handler_error)
+
+
+def _report_handler_error(future):
+    # Retrieve the exception of a coroutine handler, so it's reported instead of lost
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        traceback.print_exception(type(error), error, error.__traceback__)
+
+
+class AsyncSession:
+    def __init__(self, connection, session_id):
+        self._connection = connection
+        self.session_id = session_id
+        self.closed = False
+
+        self.messages = {}
+        self.event_handlers = {}
+
+    def on_message(self, message):
+        if 'id' in message:
+            future = self.messages.pop(message['id'], None)
+            if future is None or future.done():
+                return
+            if 'error' in message:
+                future.set_exception(BrowserError(message['error']))
+            else:
+                future.set_result(message.get('result'))
+        elif 'method' in message:
+            dispatch_event(self.event_handlers, message)
+
+    async def send(self, method, _timeout=None, **kwargs):
+        if self.closed:
+            raise BrowserError('Session %s is closed' % self.session_id)
+        message = {'method': method, 'params': kwargs}
+        return await self._connection._send(message, session=self, timeout=_timeout)
+
+    def on(self, method, cb):
+        self.event_handlers[method] = self.event_handlers.get(method, [])
+        self.event_handlers[method].append(cb)
+        return Subscription(self, method, cb)
+
+    def off(self, method, cb):
+        handlers = self.event_handlers.get(method, [])
+        if cb in handlers:
+            handlers.remove(cb)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for future in self.messages.values():
+            if not future.done():
+                future.set_exception(BrowserError('Session %s is closed' % self.session_id))
+        self.messages.clear()
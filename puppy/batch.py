@@ -0,0 +1,27 @@
+class Batch:
+    '''Commands written back-to-back without waiting for each other's replies. Used through the
+    `batch()` context manager of a `Connection` or `Session`:
+
+       ```
+       with page.session.batch() as batch:
+           batch.send('Network.enable')
+           batch.send('Page.enable')
+       network_result, page_result = batch.results
+       ```
+
+    Replies are gathered when the block exits; the first command that failed raises its error there.
+    '''
+
+    def __init__(self, sender):
+        self._sender = sender
+        self._futures = []
+        self.results = None
+
+    def send(self, method, **kwargs):
+        future = self._sender.send_async(method, **kwargs)
+        self._futures.append(future)
+        return future
+
+    def wait(self):
+        self.results = [self._sender.wait(future) for future in self._futures]
+        return self.results
@@ -1,18 +1,71 @@
 import json
 import os
+import re
 import shutil
 import subprocess
 import tempfile
 import time
 
+from collections import deque
+from threading import Event, Thread
 from urllib.parse import urlparse
-from urllib.request import urlopen, URLError
+from urllib.request import urlopen
 
 from .chromium_downloader import download_chromium, get_executable_path
+from .browser_context import BrowserContext
 from .connection import Connection
 from .exceptions import BrowserError
 from .page import Page
-from .utils import get_free_port
+from .scheduler import TabScheduler
+from .transport import PipeTransport
+
+
+# Chrome prints this once its devtools server is up. Launched with `--remote-debugging-port=0` the line is
+# the only way to learn which port it picked.
+DEVTOOLS_LISTENING_RE = re.compile(r'^DevTools listening on (ws://\S+)')
+
+# How the connection reaches the browser: its websocket endpoint, or the `--remote-debugging-pipe` pipes
+TRANSPORTS = ('websocket', 'pipe')
+
+
+def build_command(executable_path,
+                  port=0,
+                  headless=True,
+                  proxy_uri=None,
+                  user_agent=None,
+                  user_data_dir=None,
+                  args=None,
+                  pipe=False):
+    """Build the command line used to launch Chromium with remote debugging enabled, over `port` or, with
+    `pipe`, over file descriptors 3 and 4."""
+    if not executable_path:
+        executable_path = get_executable_path()
+        if not os.path.exists(executable_path):
+            download_chromium()
+    cmd = [
+        executable_path,
+        'about:blank',
+        '--remote-debugging-pipe' if pipe else '--remote-debugging-port={}'.format(port)
+    ]
+
+    if args is not None:
+        cmd.extend(args)
+
+    if headless is True:
+        cmd.append('--headless')
+
+    if user_agent is not None:
+        cmd.append('--user-agent={}'.format(user_agent))
+
+    if user_data_dir is not None:
+        cmd.append('--user-data-dir={}'.format(user_data_dir))
+
+    if proxy_uri is not None:
+        parsed_uri = urlparse(proxy_uri)
+        proxy_address = '{}://{}:{}'.format(parsed_uri.scheme, parsed_uri.hostname, parsed_uri.port)
+        cmd.append('--proxy-server={}'.format(proxy_address))
+
+    return cmd
 
 
 class Browser:
@@ -23,70 +76,212 @@ class Browser:
                  user_data_dir=None,
                  executable_path=None,
                  debug=False,
-                 args=None):
-        if not executable_path:
-            executable_path = get_executable_path()
-            if not os.path.exists(executable_path):
-                download_chromium()
-        self._port = get_free_port()
-        cmd = [
-            executable_path,
-            'about:blank',
-            '--remote-debugging-port={}'.format(self._port)
-        ]
-
-        if args is not None:
-            cmd.extend(args)
-
-        if headless is True:
-            cmd.append('--headless')
-
-        if user_agent is not None:
-            cmd.append('--user-agent={}'.format(user_agent))
-
+                 args=None,
+                 transport='websocket',
+                 response_cache=None):
+        if transport not in TRANSPORTS:
+            raise ValueError('Unknown transport %s, expected one of %s' % (transport, ', '.join(TRANSPORTS)))
         self._tmp_user_data_dir = None
         if user_data_dir is None:
             self._tmp_user_data_dir = tempfile.mkdtemp(dir='/tmp')
-        cmd.append('--user-data-dir={}'.format(user_data_dir or self._tmp_user_data_dir))
 
         self._proxy_uri = proxy_uri
-        if self._proxy_uri is not None:
-            parsed_uri = urlparse(self._proxy_uri)
-            proxy_address = '{}://{}:{}'.format(parsed_uri.scheme, parsed_uri.hostname, parsed_uri.port)
-            cmd.append('--proxy-server={}'.format(proxy_address))
+        self._response_cache = response_cache
+        cmd = build_command(executable_path,
+                            0,
+                            headless=headless,
+                            proxy_uri=self._proxy_uri,
+                            user_agent=user_agent,
+                            user_data_dir=user_data_dir or self._tmp_user_data_dir,
+                            args=args,
+                            pipe=transport == 'pipe')
 
-        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        self.websocket_endpoint = self._wait_for_ws_endpoint('http://localhost:{}/json/version'.format(self._port))
-        self.connection = Connection(self.websocket_endpoint, debug=debug)
-        pages = json.loads(urlopen('http://localhost:{}/json/list'.format(self._port)).read())
+        if transport == 'pipe':
+            pipe_transport, self.process = PipeTransport.launch(cmd)
+            self.websocket_endpoint = None
+            self.connection = Connection(transport=pipe_transport, debug=debug)
+        else:
+            self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            self.websocket_endpoint = self._wait_for_ws_endpoint()
+            self.connection = Connection(self.websocket_endpoint, debug=debug)
 
         self._pages = []
-        pages = [p for p in pages if p['type'] == 'page']
-        if len(pages):
-            for page in pages:
-                self._pages.append(Page(self.connection, page['id'], proxy_uri=self._proxy_uri))
+        self._contexts = []
+        self._attached_target_ids = set()
+        targets = self.targets()
+        if len(targets):
+            for target in targets:
+                self.attach(target['targetId'])
             self.page = self._pages[0]
         else:
             self.page = self._new_page()
 
+    @classmethod
+    def connect(cls, endpoint, proxy_uri=None, debug=False, close_pages=True, response_cache=None):
+        """Attach to a browser that is already running instead of launching one.
+
+        The browser's existing tabs are left alone, a new tab is opened for `page`. Closing the returned
+        Browser only disconnects from the browser, which keeps running.
+
+        Args:
+            endpoint (str): The browser's devtools websocket url (ws://host:port/devtools/browser/<id>), or
+                its http://host:port address to look the websocket url up from.
+            proxy_uri (str, optional): The proxy the browser was started with, for its credentials.
+            debug (bool, optional): Print every message exchanged with the browser.
+            close_pages (bool, optional): Whether `close` closes the tabs and contexts opened through this
+                Browser. Defaults to True.
+            response_cache (ResponseCache, optional): A cache serving the static assets of every page.
+
+        Returns:
+            The connected Browser.
+        """
+        if endpoint.startswith(('http://', 'https://')):
+            endpoint = json.loads(urlopen(endpoint.rstrip('/') + '/json/version').read())['webSocketDebuggerUrl']
+        browser = cls.__new__(cls)
+        browser.process = None
+        browser._tmp_user_data_dir = None
+        browser._proxy_uri = proxy_uri
+        browser._response_cache = response_cache
+        browser._close_pages = close_pages
+        browser.websocket_endpoint = endpoint
+        browser.connection = Connection(endpoint, debug=debug)
+        browser._pages = []
+        browser._contexts = []
+        browser._attached_target_ids = set()
+        browser.page = browser._new_page()
+        return browser
+
+    def targets(self):
+        """List the browser's tabs, including those not opened by this Browser.
+
+        Returns:
+            The `Target.TargetInfo` dicts of every page target.
+        """
+        response = self.connection.send('Target.getTargets')
+        return [t for t in response['targetInfos'] if t['type'] == 'page']
+
+    def attach(self, target_id):
+        """Control an existing tab, see `targets`. Attached tabs are never closed by `close`.
+
+        Returns:
+            The tab's Page.
+        """
+        page = self._wrap_page(target_id)
+        self._pages.append(page)
+        self._attached_target_ids.add(target_id)
+        return page
+
+    def new_page(self, url='about:blank'):
+        """Open a new tab.
+
+        Args:
+            url (str, optional): The url the tab starts on. Defaults to "about:blank".
+
+        Returns:
+            The new Page.
+        """
+        page = self._create_page(url)
+        self._pages.append(page)
+        return page
+
+    def new_context(self):
+        """Create an isolated browser context, with its own cookies, storage and cache. Much cheaper than
+        launching another browser.
+
+        Returns:
+            The new BrowserContext.
+        """
+        response = self.connection.send('Target.createBrowserContext')
+        context = BrowserContext(self, response['browserContextId'])
+        self._contexts.append(context)
+        return context
+
+    @property
+    def pages(self):
+        """The open pages of this browser."""
+        return [page for page in self._pages if not page.closed]
+
+    def map(self, jobs, fn, concurrency=4, timeout=None, retries=2, backoff=1.0, navigate=True):
+        """Run `fn` over many jobs using up to `concurrency` tabs at once, yielding results as they finish.
+
+        Jobs are only taken from `jobs` when a tab is free, so it can be a generator of any length:
+
+           ```
+           for result in browser.map(urls, lambda page, url: page.extract(schema), concurrency=8):
+               print(result.job, result.error or result.value)
+           ```
+
+        Args:
+            jobs (iterable): The jobs to run, usually urls.
+            fn (callable): Called as `fn(page, job)`; its return value is the job's result.
+            concurrency (int, optional): Maximum number of tabs used at once. Defaults to 4.
+            timeout (int, optional): Maximum number of seconds a single attempt, navigation included, may
+                take. Defaults to no limit, in which case navigations time out after 30 seconds.
+            retries (int, optional): How many times a job failing with a PageError or BrowserError is
+                retried. Defaults to 2.
+            backoff (float, optional): Seconds to wait before the first retry, doubled on every further
+                retry. Defaults to 1.
+            navigate (bool, optional): Whether to visit each job as a url before calling `fn`. Defaults to True.
+
+        Returns:
+            A generator of `MapResult(job, value, error, attempts)` in completion order.
+        """
+        scheduler = TabScheduler(self,
+                                 fn,
+                                 concurrency=concurrency,
+                                 timeout=timeout,
+                                 retries=retries,
+                                 backoff=backoff,
+                                 navigate=navigate)
+        return scheduler.run(jobs)
+
+    @property
+    def contexts(self):
+        """The open browser contexts created with `new_context`."""
+        return list(self._contexts)
+
+    def _create_page(self, url, browser_context_id=None):
+        params = {'url': url}
+        if browser_context_id is not None:
+            params['browserContextId'] = browser_context_id
+        response = self.connection.send('Target.createTarget', **params)
+        return self._wrap_page(response['targetId'], browser_context_id)
+
+    def _wrap_page(self, target_id, browser_context_id=None):
+        page = Page(self.connection, target_id, proxy_uri=self._proxy_uri, browser_context_id=browser_context_id)
+        if self._response_cache is not None:
+            page.response_cache = self._response_cache
+        return page
+
     def _new_page(self, url='about:blank'):
-        response = self.connection.send('Target.createTarget', url=url)
-        target_id = response['targetId']
-        self.page = Page(self.connection, target_id, proxy_uri=self._proxy_uri)
-        self._pages.append(self.page)
+        self.page = self.new_page(url)
         return self.page
 
-    def _wait_for_ws_endpoint(self, url, timeout=5):
-        PAUSE = 0.1
-        waited = 0.0
-        while waited < timeout:
-            try:
-                response = urlopen(url)
-                return json.loads(response.read())['webSocketDebuggerUrl']
-            except URLError:
-                time.sleep(PAUSE)
-                waited += PAUSE
-        raise BrowserError('Timed out waiting for Chrome to open')
+    def _wait_for_ws_endpoint(self, timeout=5):
+        # Chrome's output has to be read for as long as it runs, or it blocks once the pipe buffer is full
+        found = Event()
+        endpoint = []
+        output = deque(maxlen=20)
+
+        def read_output():
+            for line in iter(self.process.stdout.readline, b''):
+                line = line.decode('utf-8', 'replace').rstrip()
+                if not found.is_set():
+                    output.append(line)
+                    match = DEVTOOLS_LISTENING_RE.match(line)
+                    if match:
+                        endpoint.append(match.group(1))
+                        found.set()
+            found.set()
+
+        thread = Thread(target=read_output)
+        thread.daemon = True
+        thread.start()
+        if not found.wait(timeout):
+            raise BrowserError('Timed out waiting for Chrome to open')
+        if not endpoint:
+            raise BrowserError('Chrome exited before opening its devtools server:\n{}'.format('\n'.join(output)))
+        return endpoint[0]
 
     def _clear_temp_user_data_dir(self, timeout=5):
         waited = 0.0
@@ -98,6 +293,19 @@ class Browser:
         shutil.rmtree(self._tmp_user_data_dir)
 
     def close(self):
+        if self.process is None:
+            # Connected with `connect`: the browser isn't ours to close
+            if self._close_pages:
+                for context in self.contexts:
+                    context.close()
+                for page in self.pages:
+                    if page._target_id not in self._attached_target_ids:
+                        try:
+                            page.close()
+                        except BrowserError:
+                            pass
+            self.connection.close()
+            return
         self.connection.send('Browser.close')
         self.connection.close()
         self.process.terminate()
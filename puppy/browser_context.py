@@ -0,0 +1,60 @@
+from .exceptions import BrowserError
+
+
+class BrowserContext:
+    '''An isolated, incognito-like context of a running browser. Its pages share cookies, storage and cache
+    with each other but not with the browser's other contexts:
+
+       ```
+       with browser.new_context() as context:
+           page = context.new_page()
+           page.goto('https://example.com')
+       ```
+
+    Closing the context closes its pages and disposes everything it stored.
+    '''
+
+    def __init__(self, browser, context_id):
+        self._browser = browser
+        self._context_id = context_id
+        self._pages = []
+        self.closed = False
+
+    def new_page(self, url='about:blank'):
+        """Open a new tab in this context.
+
+        Args:
+            url (str, optional): The url the tab starts on. Defaults to "about:blank".
+
+        Returns:
+            The new Page.
+        """
+        if self.closed:
+            raise BrowserError('The browser context is closed')
+        page = self._browser._create_page(url, browser_context_id=self._context_id)
+        self._pages.append(page)
+        return page
+
+    @property
+    def pages(self):
+        """The open pages of this context."""
+        return [page for page in self._pages if not page.closed]
+
+    def close(self):
+        """Close the context's pages and dispose of the context."""
+        if self.closed:
+            return
+        self.closed = True
+        for page in self.pages:
+            try:
+                page.close()
+            except BrowserError:
+                pass
+        self._browser._contexts.remove(self)
+        self._browser.connection.send('Target.disposeBrowserContext', browserContextId=self._context_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
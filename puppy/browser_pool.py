@@ -0,0 +1,224 @@
+import time
+
+from contextlib import contextmanager
+from threading import Condition
+
+from .browser import Browser
+from .exceptions import BrowserError, PageError
+
+
+class PooledBrowser:
+    '''A browser owned by a `BrowserPool`, with the bookkeeping needed to decide when to recycle it'''
+
+    def __init__(self, browser, pages):
+        self.browser = browser
+        self.pages = pages
+        self.created_at = time.monotonic()
+        self.uses = 0
+        self.leased = 0
+        self.retiring = False
+
+    def heap_usage(self):
+        return sum(page.session.send('Runtime.getHeapUsage')['usedSize'] for page in self.pages)
+
+
+class BrowserPool:
+    '''Keeps warm browsers with pre-created pages and leases the pages out:
+
+       ```
+       pool = BrowserPool(size=4, pages_per_browser=2)
+       with pool.lease() as page:
+           page.goto('https://example.com')
+       pool.close()
+       ```
+
+    Pages are reset when returned. Each page of a browser lives in its own browser context, so the reset
+    doesn't clear the cookies or storage of its siblings, which may be leased at the time. A browser is
+    replaced once it has served `max_uses` leases, is older than `max_age` seconds or its pages' javascript
+    heaps use more than `max_heap_bytes` in total; it keeps serving its outstanding leases until they are
+    returned.
+    '''
+
+    def __init__(self,
+                 size=2,
+                 pages_per_browser=1,
+                 max_uses=None,
+                 max_age=None,
+                 max_heap_bytes=None,
+                 browser_factory=Browser,
+                 **browser_kwargs):
+        self.size = size
+        self.pages_per_browser = pages_per_browser
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.max_heap_bytes = max_heap_bytes
+        self.closed = False
+
+        self._browser_factory = browser_factory
+        self._browser_kwargs = browser_kwargs
+        self._browsers = []
+        self._idle = []
+        self._condition = Condition()
+
+        self._waiters = 0
+        self._leases = 0
+        self._lease_wait_total = 0.0
+        self._lease_wait_max = 0.0
+        self._recycles = 0
+        self._failed_resets = 0
+        self._failed_replacements = 0
+        self._launching = 0
+
+        for _ in range(size):
+            self._add_browser()
+
+    @contextmanager
+    def lease(self, timeout=None):
+        """A context manager lending out a page from the pool until the block exits.
+
+        Args:
+            timeout (int, optional): Maximum number of seconds to wait for a page to be free. Waits forever
+                by default.
+
+        Raises:
+            BrowserError: If no page becomes free in time, the pool is closed or it lost all its browsers.
+        """
+        pooled, page = self._acquire(timeout)
+        try:
+            yield page
+        finally:
+            self._release(pooled, page)
+
+    def metrics(self):
+        with self._condition:
+            return {
+                'browsers': len(self._browsers),
+                'idle_pages': len(self._idle),
+                'waiters': self._waiters,
+                'leases': self._leases,
+                'lease_wait_avg': self._lease_wait_total / self._leases if self._leases else 0.0,
+                'lease_wait_max': self._lease_wait_max,
+                'recycles': self._recycles,
+                'failed_resets': self._failed_resets,
+                'failed_replacements': self._failed_replacements,
+            }
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            browsers, self._browsers, self._idle = self._browsers, [], []
+            self._condition.notify_all()
+        for pooled in browsers:
+            self._close_browser(pooled)
+
+    def _add_browser(self):
+        with self._condition:
+            self._launching += 1
+        try:
+            browser = self._browser_factory(**self._browser_kwargs)
+            try:
+                pages = [browser.page] + [browser.new_context().new_page() for _ in range(self.pages_per_browser - 1)]
+            except BaseException:
+                self._close_browser(PooledBrowser(browser, []))
+                raise
+        finally:
+            with self._condition:
+                self._launching -= 1
+        pooled = PooledBrowser(browser, pages)
+        with self._condition:
+            if self.closed:
+                closed = True
+            else:
+                closed = False
+                self._browsers.append(pooled)
+                self._idle.extend((pooled, page) for page in pages)
+                self._condition.notify(len(pages))
+        if closed:
+            self._close_browser(pooled)
+
+    def _acquire(self, timeout):
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+        with self._condition:
+            self._waiters += 1
+            try:
+                while not self._idle:
+                    if self.closed:
+                        raise BrowserError('The browser pool is closed')
+                    if not self._browsers and not self._launching:
+                        raise BrowserError('The browser pool has no browsers left, replacing them failed')
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise BrowserError('Timed out waiting for a page from the browser pool')
+                    self._condition.wait(remaining)
+            finally:
+                self._waiters -= 1
+            pooled, page = self._idle.pop()
+            pooled.leased += 1
+            waited = time.monotonic() - started
+            self._leases += 1
+            self._lease_wait_total += waited
+            self._lease_wait_max = max(self._lease_wait_max, waited)
+        return pooled, page
+
+    def _release(self, pooled, page):
+        with self._condition:
+            pooled.uses += 1
+            reset = not pooled.retiring
+        # Anything going wrong while resetting, even unexpectedly, retires the browser
+        retire, failed = True, False
+        try:
+            if reset:
+                try:
+                    page.reset()
+                    retire = self._should_recycle(pooled)
+                except (BrowserError, PageError):
+                    failed = True
+        finally:
+            self._check_in(pooled, page, retire, failed)
+
+    def _check_in(self, pooled, page, retire, failed_reset):
+        with self._condition:
+            self._failed_resets += failed_reset
+            pooled.retiring = pooled.retiring or retire
+            pooled.leased -= 1
+            if not pooled.retiring and not self.closed:
+                self._idle.append((pooled, page))
+                self._condition.notify()
+                return
+            # Take the browser's other pages out of circulation and recycle it once they're all back
+            self._idle = [(p, pg) for p, pg in self._idle if p is not pooled]
+            if pooled.leased or pooled not in self._browsers:
+                return
+            self._browsers.remove(pooled)
+            self._recycles += 1
+            replace = not self.closed
+
+        self._close_browser(pooled)
+        if replace:
+            self._replace_browser()
+
+    def _replace_browser(self):
+        # This runs while a lease is being returned, so a failed launch mustn't replace the caller's result or
+        # exception. Waiters are woken up to fail if that left the pool without browsers.
+        try:
+            self._add_browser()
+        except Exception:
+            with self._condition:
+                self._failed_replacements += 1
+                self._condition.notify_all()
+
+    def _should_recycle(self, pooled):
+        if self.max_uses is not None and pooled.uses >= self.max_uses:
+            return True
+        if self.max_age is not None and time.monotonic() - pooled.created_at >= self.max_age:
+            return True
+        if self.max_heap_bytes is not None and pooled.heap_usage() >= self.max_heap_bytes:
+            return True
+        return False
+
+    def _close_browser(self, pooled):
+        try:
+            pooled.browser.close()
+        except BrowserError:
+            pass
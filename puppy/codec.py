@@ -0,0 +1,62 @@
+import json
+import re
+
+from collections import namedtuple
+
+
+Codec = namedtuple('Codec', ['name', 'loads', 'dumps'])
+
+# Chrome writes the method first in every event it sends, so an event's name can be read without decoding
+# the (possibly large) params that follow it
+_EVENT_METHOD_RE = re.compile(r'\{\s*"method"\s*:\s*"([^"]+)"')
+
+
+def _json_codec():
+    return Codec('json', json.loads, json.dumps)
+
+
+def _orjson_codec():
+    import orjson
+    return Codec('orjson', orjson.loads, lambda obj: orjson.dumps(obj).decode())
+
+
+def _ujson_codec():
+    import ujson
+    return Codec('ujson', ujson.loads, ujson.dumps)
+
+
+CODECS = {
+    'orjson': _orjson_codec,
+    'ujson': _ujson_codec,
+    'json': _json_codec,
+}
+
+
+def get_codec(name=None):
+    """Get the codec used to encode and decode devtools messages.
+
+    Args:
+        name (str, optional): One of "orjson", "ujson" or "json". Defaults to the fastest one installed.
+
+    Returns:
+        A Codec with `loads` and `dumps` functions. `dumps` always returns a str.
+
+    Raises:
+        ValueError: If the codec is unknown.
+        ImportError: If the requested codec's library is not installed.
+    """
+    if name is not None:
+        if name not in CODECS:
+            raise ValueError('Unknown codec %s, expected one of %s' % (name, ', '.join(CODECS)))
+        return CODECS[name]()
+    for factory in CODECS.values():
+        try:
+            return factory()
+        except ImportError:
+            continue
+
+
+def peek_event_method(message_raw):
+    """Return the method of a raw event message, or None if the message is not an event."""
+    match = _EVENT_METHOD_RE.match(message_raw)
+    return match.group(1) if match else None
@@ -1,126 +1,213 @@
-import json
-import queue
+import itertools
 
-from threading import Event, Thread
+from collections import Counter
+from contextlib import contextmanager
+from threading import Lock, Thread
 
-import websocket
-from websocket._exceptions import WebSocketConnectionClosedException
+from .batch import Batch
+from .codec import get_codec, peek_event_method
+from .event_dispatcher import DEFAULT_WORKERS, EventDispatcher
+from .exceptions import BrowserError, ConnectionClosedError
+from .pending_commands import PendingCommands
+from .session import Session, Subscription
+from .transport import WebSocketTransport
 
-from .exceptions import BrowserError
-from .session import Session
 
+# Events the connection itself relies on, which are decoded whether or not anyone subscribed to them
+INTERNAL_EVENTS = {'Target.receivedMessageFromTarget', 'Target.detachedFromTarget'}
 
-MESSAGE_TIMEOUT = 300
+# JSON-RPC error code for a command called with parameters the browser doesn't accept
+INVALID_PARAMS = -32602
+
+
+def _is_flatten_rejected(error):
+    # Whether attaching failed because the browser doesn't accept `flatten`, rather than because of the
+    # target itself, which is reported with the same error code
+    details = error.args[0] if error.args else None
+    if not isinstance(details, dict) or details.get('code') != INVALID_PARAMS:
+        return False
+    return 'target' not in '{} {}'.format(details.get('message', ''), details.get('data', '')).lower()
 
 
 class Connection:
-    def __init__(self, endpoint, debug=False):
-        self.endpoint = endpoint
+    '''A connection to a browser, over its websocket `endpoint` unless another `transport` (see
+    `puppy.transport`) is given'''
+
+    def __init__(self, endpoint=None, debug=False, flatten=True, codec=None, event_workers=DEFAULT_WORKERS, transport=None):
         self.closed = False
-        self._ws = websocket.create_connection(self.endpoint, enable_multithread=True)
+        self.flatten = flatten
+        self.codec = get_codec(codec)
+        self.skipped_events = 0
+        self._transport = transport or WebSocketTransport(endpoint)
+        self.endpoint = self._transport.endpoint
 
-        self.messages = {}
+        self.pending = PendingCommands()
         self._sessions = {}
-        self.events_queue = queue.Queue()
+        self.dispatcher = EventDispatcher(event_workers)
         self.event_handlers = {}
+        self._subscriptions = Counter()
+        # Handlers come and go on any thread, e.g. a LifecycleWatcher per navigation
+        self._subscriptions_lock = Lock()
 
-        self._message_id = 0
+        self._message_ids = itertools.count()
         self._recv_thread = Thread(target=self._recv_loop)
         self._recv_thread.daemon = True
         self._recv_thread.start()
 
-        self._handle_event_thread = Thread(target=self._handle_event_loop)
-        self._handle_event_thread.setDaemon(True)
-        self._handle_event_thread.start()
+        self._events = self.dispatcher.register(self._handle_event)
 
         self._debug = debug
 
     def new_session(self, target_id):
-        response = self.send('Target.attachToTarget', targetId=target_id)
+        """Attach to a target. Sessions are flattened when the browser supports it, so their messages are
+        exchanged directly instead of being wrapped in `Target.sendMessageToTarget`."""
+        if self.flatten:
+            try:
+                response = self.send('Target.attachToTarget', targetId=target_id, flatten=True)
+            except BrowserError as e:
+                if not _is_flatten_rejected(e):
+                    raise
+                # Older Chromes don't know about flat sessions
+                self.flatten = False
+        if not self.flatten:
+            response = self.send('Target.attachToTarget', targetId=target_id)
         session_id = response['sessionId']
-        session = Session(self, session_id)
+        session = Session(self, session_id, flatten=self.flatten)
         self._sessions[session_id] = session
         return session
 
     def _recv_loop(self):
         while not self.closed:
             try:
-                message_raw = self._ws.recv()
+                message_raw = self._transport.recv()
                 if self._debug:  # TODO: set up a logger and format this nicely
                     print('recieved -- ', message_raw[:1000])
-            except WebSocketConnectionClosedException:
+            except ConnectionClosedError:
                 if self.closed:
                     continue
                 else:
+                    self.close()
                     raise
-            message = json.loads(message_raw)
+            if not self._should_decode(message_raw):
+                continue
+            message = self.codec.loads(message_raw)
+
+            # Messages from flattened sessions carry their session id at the top level
+            if 'sessionId' in message:
+                session = self._sessions.get(message['sessionId'])
+                if session is not None:
+                    session.on_message(message)
 
             # Messages meant to be passed to some session
-            if message.get('method') == 'Target.receivedMessageFromTarget':
-                message_from_target = json.loads(message['params']['message'])
-                session_id = message['params']['sessionId']
-                self._sessions.get(session_id).on_message(message_from_target)
+            elif message.get('method') == 'Target.receivedMessageFromTarget':
+                session = self._sessions.get(message['params']['sessionId'])
+                if session is not None and self._should_decode(message['params']['message']):
+                    session.on_message(self.codec.loads(message['params']['message']))
 
             # Responses to messages sent from this connection
             elif 'id' in message:
-                if 'error' in message:
-                    self.messages[message['id']]['error'] = message['error']
-                else:
-                    self.messages[message['id']]['result'] = message.get('result')
-                self.messages[message['id']]['event'].set()
+                self.pending.resolve(message)
 
             # Events fired for this connection
             elif 'method' in message:
-                self.events_queue.put(message)
-        self._ws.close()
-
-    def _handle_event_loop(self):
-        while not self.closed:
-            try:
-                event = self.events_queue.get(timeout=1)
-            except queue.Empty:
-                continue
-
-            if event['method'] in self.event_handlers:
-                for cb in self.event_handlers[event['method']]:
-                    cb(**event['params'])
+                if message['method'] == 'Target.detachedFromTarget':
+                    session = self._sessions.pop(message['params'].get('sessionId'), None)
+                    if session is not None:
+                        session.close()
+                self._events.put(message)
+        self._transport.close()
+
+    def _should_decode(self, message_raw):
+        # Nobody listens to most of the events Chrome sends (e.g. Network.dataReceived), so don't pay to
+        # decode them
+        method = peek_event_method(message_raw)
+        if method is None or method in self._subscriptions or method in INTERNAL_EVENTS:
+            return True
+        self.skipped_events += 1
+        return False
+
+    def _subscribe(self, method):
+        with self._subscriptions_lock:
+            self._subscriptions[method] += 1
+
+    def _unsubscribe(self, method):
+        with self._subscriptions_lock:
+            self._subscriptions[method] -= 1
+            if self._subscriptions[method] <= 0:
+                del self._subscriptions[method]
+
+    def _handle_event(self, event):
+        for cb in list(self.event_handlers.get(event['method'], ())):
+            cb(**event['params'])
+
+    def send(self, method, _timeout=None, **kwargs):
+        return self.wait(self.send_async(method, _timeout=_timeout, **kwargs))
+
+    def send_async(self, method, _timeout=None, **kwargs):
+        """Send a command without waiting for its reply.
+
+        Args:
+            method (str): The devtools protocol method to call.
+            _timeout (float, optional): Seconds before the command expires. Defaults to `MESSAGE_TIMEOUT`.
+            **kwargs: The method's parameters.
+
+        Returns:
+            A `concurrent.futures.Future` resolved with the command's result, or with a BrowserError if the
+            browser answered with an error or the command expired.
+        """
+        message = {'method': method, 'params': kwargs}
+        return self._send_async(message, _timeout)
 
-            self.events_queue.task_done()
+    @contextmanager
+    def batch(self):
+        """Pipeline several commands; see `puppy.batch.Batch`."""
+        batch = Batch(self)
+        yield batch
+        batch.wait()
 
-    def send(self, method, **kwargs):
-        message = {'method': method, 'params': kwargs}
-        return self._send(message)
+    def wait(self, future):
+        return self.pending.wait(future)
 
     def _send(self, message):
+        return self.wait(self._send_async(message))
+
+    def _send_async(self, message, timeout=None):
+        if self.closed:
+            raise BrowserError('Connection to browser closed')
         if 'id' not in message:
-            id_ = self.message_id()
-            message['id'] = id_
-        event_ = Event()
-        self.messages[id_] = {'event': event_}
-        if self._debug:  # TODO: set up a logger and format this nicely
-            print('sent -- ', json.dumps(message))
-        self._ws.send(json.dumps(message))
-        if not event_.wait(timeout=MESSAGE_TIMEOUT):
-            raise BrowserError('Timed out waiting for response from browser')
-        if 'error' in self.messages[id_]:
-            raise BrowserError(self.messages[id_]['error'])
-        else:
-            return self.messages[id_]['result']
+            message['id'] = self.message_id()
+        future = self.pending.add(message['id'], timeout)
+        self._send_no_wait(message)
+        return future
 
     def _send_no_wait(self, message):
         if 'id' not in message:
-            id_ = self.message_id()
-            message['id'] = id_
-        self._ws.send(json.dumps(message))
+            message['id'] = self.message_id()
+        message_raw = self.codec.dumps(message)
+        if self._debug:  # TODO: set up a logger and format this nicely
+            print('sent -- ', message_raw)
+        self._transport.send(message_raw)
 
     def on(self, method, cb):
         self.event_handlers[method] = self.event_handlers.get(method, [])
         self.event_handlers[method].append(cb)
+        self._subscribe(method)
+        return Subscription(self, method, cb)
+
+    def off(self, method, cb):
+        handlers = self.event_handlers.get(method, [])
+        if cb in handlers:
+            handlers.remove(cb)
+            self._unsubscribe(method)
 
     def message_id(self):
-        id_ = self._message_id
-        self._message_id += 1
-        return id_
+        return next(self._message_ids)
 
     def close(self):
         self.closed = True
+        self.pending.cancel_all(BrowserError('Connection to browser closed'))
+        for session in list(self._sessions.values()):
+            session.close()
+        self._events.close()
+        self.dispatcher.close()
+        self._transport.close()
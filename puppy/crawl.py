@@ -0,0 +1,287 @@
+"""Crawl a list of urls with a pool of worker processes, each driving its own browser:
+
+    python -m puppy.crawl urls.txt --workers 8 --tabs 4 --output results.jsonl
+
+A single process is bound by the json decoding and event handling of its connection long before Chrome is,
+so the work is spread over processes, and within each process over tabs with `Browser.map`. Results are
+written as JSON lines in completion order. A worker that dies is replaced and its unfinished jobs are sent
+to the replacement.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+from .browser import Browser
+from .exceptions import BrowserError
+
+
+# Jobs sent ahead to every worker, per tab, so it never waits on the parent for its next url
+PREFETCH_PER_TAB = 2
+
+
+def crawl_page(page, url, timeout=30, schema=None):
+    """The default job: visit `url` and return its status and html, or the data `schema` extracts from it."""
+    response = page.goto(url, timeout=timeout)
+    if schema is not None:
+        return page.extract(schema)
+    return {
+        'status': response.status if response is not None else None,
+        'html': page.content(),
+    }
+
+
+def _worker_main(worker_id, jobs, results, tabs, timeout, retries, schema, browser_kwargs):
+    browser = Browser(**browser_kwargs)
+
+    def fn(page, job):
+        return crawl_page(page, job[1], timeout=timeout or 30, schema=schema)
+
+    def pull():
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            yield job
+
+    try:
+        for result in browser.map(pull(), fn, concurrency=tabs, timeout=timeout, retries=retries, navigate=False):
+            seq, url = result.job
+            record = {
+                'url': url,
+                'result': result.value,
+                'error': None if result.error is None else '{}: {}'.format(type(result.error).__name__, result.error),
+                'attempts': result.attempts,
+                'worker': worker_id,
+            }
+            results.put(('result', worker_id, seq, record))
+    finally:
+        browser.close()
+    results.put(('done', worker_id, None, None))
+
+
+class WorkerSlot:
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.process = None
+        self.jobs = None
+        self.outstanding = {}
+        self.sent_stop = False
+        self.finished = False
+        self.completed = 0
+        self.failed = 0
+        self.restarts = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+
+
+class Crawler:
+    '''Spreads jobs over `workers` processes with `tabs` tabs each and collects their results:
+
+       ```
+       crawler = Crawler(workers=8, tabs=4)
+       for record in crawler.run(open('urls.txt')):
+           print(record['url'], record['error'])
+       print(crawler.summary())
+       ```
+    '''
+
+    def __init__(self,
+                 workers=None,
+                 tabs=4,
+                 timeout=30,
+                 retries=2,
+                 schema=None,
+                 max_restarts=None,
+                 **browser_kwargs):
+        self.workers = workers or os.cpu_count() or 1
+        self.tabs = tabs
+        self.timeout = timeout
+        self.retries = retries
+        self.schema = schema
+        self.max_restarts = self.workers * 3 if max_restarts is None else max_restarts
+        self.browser_kwargs = browser_kwargs
+        self.slots = []
+        self._results = None
+        self._restarts = 0
+
+    def run(self, urls):
+        """Crawl `urls`, which is read lazily, yielding one result dict per url as they finish.
+
+        Raises:
+            BrowserError: If workers keep dying, more than `max_restarts` times in total.
+        """
+        urls = (url.strip() for url in urls)
+        jobs = enumerate(url for url in urls if url)
+        exhausted = False
+        # Jobs whose worker died, to be handed to whichever worker has room first
+        orphans = []
+        crash_counts = {}
+
+        self._results = multiprocessing.Queue()
+        self.slots = [WorkerSlot(worker_id) for worker_id in range(self.workers)]
+        for slot in self.slots:
+            self._start_worker(slot)
+
+        try:
+            while not all(slot.finished for slot in self.slots):
+                for slot in self.slots:
+                    if slot.finished or slot.sent_stop:
+                        continue
+                    while len(slot.outstanding) < self.tabs * PREFETCH_PER_TAB:
+                        if orphans:
+                            seq, url = orphans.pop()
+                        elif not exhausted:
+                            try:
+                                seq, url = next(jobs)
+                            except StopIteration:
+                                exhausted = True
+                                continue
+                        else:
+                            break
+                        slot.outstanding[seq] = url
+                        slot.jobs.put((seq, url))
+                    if exhausted and not orphans:
+                        slot.sent_stop = True
+                        slot.jobs.put(None)
+
+                try:
+                    kind, worker_id, seq, record = self._results.get(timeout=0.5)
+                except queue.Empty:
+                    kind = None
+                if kind == 'result':
+                    slot = self.slots[worker_id]
+                    if slot.outstanding.pop(seq, None) is not None:
+                        slot.completed += 1
+                        slot.failed += record['error'] is not None
+                        yield record
+                elif kind == 'done':
+                    self._finish(self.slots[worker_id])
+
+                for slot in self.slots:
+                    if slot.finished or slot.process.exitcode is None:
+                        continue
+                    # The worker died: drain whatever it managed to report first, then hand its jobs on
+                    for record in self._drain_results():
+                        yield record
+                    if slot.finished:
+                        continue
+                    for seq, url in slot.outstanding.items():
+                        crash_counts[seq] = crash_counts.get(seq, 0) + 1
+                        if crash_counts[seq] > self.retries:
+                            slot.failed += 1
+                            yield {'url': url, 'result': None, 'error': 'Worker crashed', 'attempts': crash_counts[seq],
+                                   'worker': slot.worker_id}
+                        else:
+                            orphans.append((seq, url))
+                    slot.outstanding = {}
+                    self._restarts += 1
+                    if self._restarts > self.max_restarts:
+                        raise BrowserError('Crawl workers crashed {} times, giving up'.format(self._restarts))
+                    slot.restarts += 1
+                    self._start_worker(slot)
+        finally:
+            for slot in self.slots:
+                if slot.process.is_alive():
+                    slot.process.terminate()
+                slot.process.join()
+
+    def summary(self):
+        """Per worker throughput of the last run, as a list of dicts."""
+        summary = []
+        for slot in self.slots:
+            elapsed = (slot.finished_at or time.monotonic()) - slot.started_at
+            summary.append({
+                'worker': slot.worker_id,
+                'completed': slot.completed,
+                'failed': slot.failed,
+                'restarts': slot.restarts,
+                'pages_per_second': round(slot.completed / elapsed, 2) if elapsed else 0.0,
+            })
+        return summary
+
+    def _finish(self, slot):
+        slot.finished = True
+        slot.finished_at = time.monotonic()
+
+    def _start_worker(self, slot):
+        slot.jobs = multiprocessing.Queue()
+        slot.sent_stop = False
+        slot.process = multiprocessing.Process(target=_worker_main,
+                                               args=(slot.worker_id,
+                                                     slot.jobs,
+                                                     self._results,
+                                                     self.tabs,
+                                                     self.timeout,
+                                                     self.retries,
+                                                     self.schema,
+                                                     self.browser_kwargs))
+        slot.process.daemon = True
+        slot.process.start()
+
+    def _drain_results(self):
+        while True:
+            try:
+                kind, worker_id, seq, record = self._results.get(timeout=0.1)
+            except queue.Empty:
+                return
+            slot = self.slots[worker_id]
+            if kind == 'done':
+                self._finish(slot)
+            elif slot.outstanding.pop(seq, None) is not None:
+                slot.completed += 1
+                slot.failed += record['error'] is not None
+                yield record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m puppy.crawl', description='Crawl a list of urls with a pool of browsers.')
+    parser.add_argument('urls', help='File with one url per line, or - for stdin')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes, one browser each')
+    parser.add_argument('--tabs', type=int, default=4, help='Number of tabs used at once by every browser')
+    parser.add_argument('--timeout', type=float, default=30, help='Seconds a single attempt at a url may take')
+    parser.add_argument('--retries', type=int, default=2, help='Times a failing url is retried')
+    parser.add_argument('--schema', help='JSON file with an extraction schema, see Page.extract. Saves the html by default')
+    parser.add_argument('--output', help='File to write the JSON lines results to. Defaults to stdout')
+    parser.add_argument('--proxy', dest='proxy_uri')
+    parser.add_argument('--user-agent')
+    parser.add_argument('--executable-path')
+    parser.add_argument('--headful', action='store_true', help='Show the browser windows')
+    args = parser.parse_args(argv)
+
+    schema = None
+    if args.schema:
+        with open(args.schema) as f:
+            schema = json.load(f)
+
+    crawler = Crawler(workers=args.workers,
+                      tabs=args.tabs,
+                      timeout=args.timeout,
+                      retries=args.retries,
+                      schema=schema,
+                      headless=not args.headful,
+                      proxy_uri=args.proxy_uri,
+                      user_agent=args.user_agent,
+                      executable_path=args.executable_path)
+
+    urls = sys.stdin if args.urls == '-' else open(args.urls)
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for record in crawler.run(urls):
+            output.write(json.dumps(record) + '\n')
+    finally:
+        if urls is not sys.stdin:
+            urls.close()
+        if output is not sys.stdout:
+            output.close()
+
+    for stats in crawler.summary():
+        print('worker {worker}: {completed} pages ({failed} failed, {restarts} restarts), {pages_per_second} pages/s'.format(**stats),
+              file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
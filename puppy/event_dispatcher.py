@@ -0,0 +1,94 @@
+import queue
+import traceback
+
+from collections import deque
+from threading import Lock, Thread
+
+
+DEFAULT_WORKERS = 4
+
+
+class EventDispatcher:
+    '''Runs the event handlers of a connection and all of its sessions on a small, fixed pool of threads.
+
+    Every session registers an `EventChannel`. Events put on a channel are handled in order and never
+    concurrently with each other, but different channels are drained in parallel by whichever worker is
+    free. The number of threads therefore doesn't grow with the number of pages or navigations.
+    '''
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.closed = False
+        self._ready = queue.Queue()
+        self._threads = []
+        for _ in range(workers):
+            thread = Thread(target=self._work_loop)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def register(self, handle_event):
+        """Create a channel whose events are passed, one at a time and in order, to `handle_event`."""
+        return EventChannel(self, handle_event)
+
+    def _schedule(self, channel):
+        self._ready.put(channel)
+
+    def _work_loop(self):
+        while True:
+            channel = self._ready.get()
+            if channel is None:
+                return
+            channel._drain()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for _ in self._threads:
+            self._ready.put(None)
+
+
+class EventChannel:
+    # Events handled before a busy channel gives its worker back to the other channels
+    MAX_BATCH = 64
+
+    def __init__(self, dispatcher, handle_event):
+        self.closed = False
+        self._dispatcher = dispatcher
+        self._handle_event = handle_event
+        self._events = deque()
+        self._scheduled = False
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._events)
+
+    def put(self, event):
+        with self._lock:
+            if self.closed:
+                return
+            self._events.append(event)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._dispatcher._schedule(self)
+
+    def _drain(self):
+        for _ in range(self.MAX_BATCH):
+            with self._lock:
+                if self.closed or not self._events:
+                    self._scheduled = False
+                    return
+                event = self._events.popleft()
+            try:
+                self._handle_event(event)
+            except Exception:
+                traceback.print_exc()
+        # Still busy: go to the back of the line so other channels get a turn
+        self._dispatcher._schedule(self)
+
+    def close(self):
+        """Drop queued events and stop handling new ones."""
+        with self._lock:
+            self.closed = True
+            self._events.clear()
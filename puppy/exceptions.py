@@ -4,3 +4,7 @@ class BrowserError(Exception):
 
 class PageError(Exception):
     pass
+
+
+class ConnectionClosedError(BrowserError):
+    pass
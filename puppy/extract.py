@@ -0,0 +1,143 @@
+import json
+import re
+
+
+# Runs a compiled schema (see `compile_schema`) against a root node, entirely inside the page
+EXTRACT_FUNCTION = '''
+(root, schema) => {
+    const query = (node, field, all) => {
+        if (!field.selector) {
+            return all ? [node] : node;
+        }
+        if (field.xpath) {
+            const document = node.ownerDocument || node;
+            if (!all) {
+                return document.evaluate(field.selector, node, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+            }
+            const result = document.evaluate(field.selector, node, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+            const nodes = [];
+            for (let i = 0; i < result.snapshotLength; i++) {
+                nodes.push(result.snapshotItem(i));
+            }
+            return nodes;
+        }
+        return all ? Array.from(node.querySelectorAll(field.selector)) : node.querySelector(field.selector);
+    };
+    const value = (node, field) => {
+        if (!node) {
+            return null;
+        }
+        if (field.fields) {
+            return extractFields(node, field.fields);
+        }
+        switch (field.type) {
+            case 'attr':
+                return node.getAttribute ? node.getAttribute(field.name) : null;
+            case 'prop':
+                return node[field.name] === undefined ? null : node[field.name];
+            case 'html':
+                return node.outerHTML === undefined ? null : node.outerHTML;
+            default:
+                return node.textContent;
+        }
+    };
+    const extractField = (node, field) => {
+        if (field.many) {
+            return query(node, field, true).map(match => value(match, field));
+        }
+        return value(query(node, field, false), field);
+    };
+    const extractFields = (node, fields) => {
+        const result = {};
+        for (const name of Object.keys(fields)) {
+            result[name] = extractField(node, fields[name]);
+        }
+        return result;
+    };
+    return extractFields(root, schema);
+}
+'''
+
+# Xpath starts with a path, a parenthesized expression, or a step such as `*//a` or `descendant::a`, where
+# CSS can't: `/` only appears inside attribute values and `::` only before pseudo-elements
+_XPATH_RE = re.compile(r'^(?:[/(]|\.\.?(?:/|$)|[\w*-]+(?:\[[^\]]*\])*/|(?:ancestor|ancestor-or-self|attribute|child|descendant|'
+                       r'descendant-or-self|following|following-sibling|namespace|parent|preceding|preceding-sibling|self)::)')
+_MODIFIER_RE = re.compile(r'(?:^|\s+)(?:@([\w:.-]+)|::(text|html)|::prop\(([\w$]+)\))$')
+
+
+def compile_schema(schema):
+    """Validate a schema and normalize its fields into the form the in-page function understands.
+
+    Raises:
+        ValueError: If the schema is malformed.
+    """
+    if not isinstance(schema, dict) or not schema:
+        raise ValueError('An extraction schema must be a non-empty dict, got %r' % (schema,))
+    return {name: _compile_field(name, field) for name, field in schema.items()}
+
+
+def _compile_field(name, field):
+    many = False
+    if isinstance(field, list):
+        if len(field) != 1:
+            raise ValueError('List field `%s` must wrap exactly one field' % name)
+        many = True
+        field = field[0]
+
+    if isinstance(field, str):
+        compiled = _compile_string_field(field)
+    elif isinstance(field, dict):
+        compiled = _compile_dict_field(name, field)
+    else:
+        raise ValueError('Field `%s` must be a string, dict or list, got %r' % (name, field))
+    compiled['many'] = many
+    return compiled
+
+
+def _compile_string_field(field):
+    compiled = {'type': 'text'}
+    selector = field.strip()
+    match = _MODIFIER_RE.search(selector)
+    if match:
+        attr, kind, prop = match.groups()
+        if attr:
+            compiled.update(type='attr', name=attr)
+        elif prop:
+            compiled.update(type='prop', name=prop)
+        else:
+            compiled['type'] = kind
+        selector = selector[:match.start()].strip()
+    compiled['selector'] = selector or None
+    compiled['xpath'] = _is_xpath(selector)
+    return compiled
+
+
+def _compile_dict_field(name, field):
+    if 'selector' in field and 'xpath' in field:
+        raise ValueError('Field `%s` can have a `selector` or an `xpath`, not both' % name)
+    compiled = {
+        'selector': field.get('xpath') or field.get('selector'),
+        'xpath': 'xpath' in field,
+        'type': 'text',
+    }
+    modifiers = [key for key in ('attr', 'prop', 'html', 'fields') if field.get(key)]
+    if len(modifiers) > 1:
+        raise ValueError('Field `%s` can only use one of %s' % (name, ', '.join(modifiers)))
+    if field.get('attr'):
+        compiled.update(type='attr', name=field['attr'])
+    elif field.get('prop'):
+        compiled.update(type='prop', name=field['prop'])
+    elif field.get('html'):
+        compiled['type'] = 'html'
+    elif field.get('fields'):
+        compiled['fields'] = compile_schema(field['fields'])
+    return compiled
+
+
+def _is_xpath(selector):
+    return bool(_XPATH_RE.match(selector))
+
+
+def extract_expression(schema, root='document'):
+    """The javascript expression extracting `schema` from `root`, ready for `Runtime.evaluate`."""
+    return '({})({}, {})'.format(EXTRACT_FUNCTION, root, json.dumps(compile_schema(schema)))
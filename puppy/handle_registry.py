@@ -0,0 +1,92 @@
+import itertools
+import weakref
+
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+
+
+DEFAULT_OBJECT_GROUP = 'puppy'
+
+
+class HandleRegistry:
+    '''Tracks the remote objects a page's JSObjects keep alive in the page's javascript heap.
+
+    Every handle is created in the current object group. `scope()` opens a new group that is released
+    with a single `Runtime.releaseObjectGroup` when it exits. Handles that are garbage collected in Python
+    are released too; since that can happen on any thread at any time, their ids are only queued by the
+    finalizer and the release commands are sent the next time the registry is used.
+    '''
+
+    def __init__(self, session):
+        self._session = session
+        self._groups = [DEFAULT_OBJECT_GROUP]
+        self._scope_ids = itertools.count()
+        self._live = {}
+        self._garbage = deque()
+        self._lock = Lock()
+
+    @property
+    def group(self):
+        return self._groups[-1]
+
+    @property
+    def live(self):
+        """The number of remote objects currently pinned by this page's handles."""
+        self.flush()
+        return len(self._live)
+
+    def track(self, js_object, group=None):
+        self.flush()
+        object_id, group = js_object._object_id, group or self.group
+        with self._lock:
+            count = self._live.get(object_id, (group, 0))[1]
+            self._live[object_id] = (group, count + 1)
+        # Calling the finalizer early, as `JSObject.release` does, queues the object exactly once
+        js_object._finalizer = weakref.finalize(js_object, self._garbage.append, object_id)
+
+    def flush(self):
+        released = []
+        with self._lock:
+            while self._garbage:
+                object_id = self._garbage.popleft()
+                if object_id not in self._live:
+                    continue
+                group, count = self._live[object_id]
+                if count > 1:
+                    self._live[object_id] = (group, count - 1)
+                else:
+                    del self._live[object_id]
+                    released.append(object_id)
+        if self._session.closed:
+            return
+        for object_id in released:
+            # Objects may already be gone with their execution context; the error doesn't matter
+            self._session.send_async('Runtime.releaseObject', objectId=object_id)
+
+    def release(self, *object_ids):
+        """Release remote objects that no handle was made for."""
+        if self._session.closed:
+            return
+        for object_id in object_ids:
+            if object_id not in self._live:
+                self._session.send_async('Runtime.releaseObject', objectId=object_id)
+
+    def clear(self):
+        """Forget every handle without releasing it, e.g. once the page navigated and its heap is gone."""
+        with self._lock:
+            self._live.clear()
+
+    @contextmanager
+    def scope(self):
+        group = '{}-scope-{}'.format(DEFAULT_OBJECT_GROUP, next(self._scope_ids))
+        self._groups.append(group)
+        try:
+            yield
+        finally:
+            self._groups.remove(group)
+            with self._lock:
+                for object_id in [id_ for id_, (g, _) in self._live.items() if g == group]:
+                    del self._live[object_id]
+            if not self._session.closed:
+                self._session.send_async('Runtime.releaseObjectGroup', objectGroup=group)
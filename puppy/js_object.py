@@ -1,19 +1,108 @@
-import json
+from .exceptions import BrowserError, PageError
+from .extract import EXTRACT_FUNCTION, compile_schema
 
-from .exceptions import BrowserError
+
+# Collect every match into an array in the page, so a whole result set costs one call however long it is
+XPATH_FUNCTION = '''
+(node, expression) => {
+    const document = node.ownerDocument || node;
+    const result = document.evaluate(expression, node, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    const elements = [];
+    for (let i = 0; i < result.snapshotLength; i++) {
+        elements.push(result.snapshotItem(i));
+    }
+    return elements;
+}
+'''
+QUERY_SELECTOR_ALL_FUNCTION = '(node, selector) => Array.from(node.querySelectorAll(selector))'
+
+# Resolve with the matching elements as soon as there are any, re-checking on every DOM mutation (and on
+# every frame when waiting for visibility, which may change without one), or with null after `timeout` ms
+WAIT_FOR_FUNCTION = '''
+(kind, selector, visible, timeout) => new Promise(resolve => {
+    const isVisible = element => {
+        const rect = element.getBoundingClientRect();
+        return window.getComputedStyle(element).visibility !== 'hidden' &&
+            !!(rect.top || rect.bottom || rect.width || rect.height);
+    };
+    const find = () => {
+        let elements;
+        if (kind === 'xpath') {
+            const result = document.evaluate(selector, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+            elements = [];
+            for (let i = 0; i < result.snapshotLength; i++) {
+                elements.push(result.snapshotItem(i));
+            }
+        } else {
+            elements = Array.from(document.querySelectorAll(selector));
+        }
+        if (visible) {
+            elements = elements.filter(element => element.nodeType === Node.ELEMENT_NODE && isVisible(element));
+        }
+        return elements;
+    };
+    let done = false;
+    const finish = elements => {
+        done = true;
+        observer.disconnect();
+        clearTimeout(timer);
+        resolve(elements);
+    };
+    const check = () => {
+        if (done) {
+            return;
+        }
+        const elements = find();
+        if (elements.length) {
+            finish(elements);
+        }
+    };
+    const observer = new MutationObserver(check);
+    const timer = setTimeout(() => done || finish(null), timeout);
+    observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    if (visible) {
+        const onFrame = () => {
+            check();
+            if (!done) {
+                requestAnimationFrame(onFrame);
+            }
+        };
+        onFrame();
+    } else {
+        check();
+    }
+})
+'''
+
+# Apply a function to every element passed in; the first `count` arguments are extra args for the function
+MAP_FUNCTION = '''
+function(count, ...args) {{
+    const fn = ({function});
+    const extra = args.slice(0, count);
+    return args.slice(count).map(element => fn(element, ...extra));
+}}
+'''
 
 
 class JSObject:
     '''An interface for interacting with javascript objects in browser runtime'''
 
-    def __init__(self, object_id, description, page):
+    def __init__(self, object_id, description, page, context_id=None, object_group=None):
         self._object_id = object_id
         self._description = description
         self._page = page
+        # Objects live in the execution context of whatever produced them, by default the page's main world
+        self._context_id = context_id if context_id is not None else page._main_context_id
+        self._page._handles.track(self, object_group)
 
     def __repr__(self):
         return f'<{self.__class__.__name__} {self._description}>'
 
+    def release(self):
+        """Let the browser free the remote object. The handle can't be used afterwards."""
+        self._finalizer()
+        self._page._handles.flush()
+
     def _method(self, method, *args):
         function = f'(element, ...args) => element.{method}(...args)'
         args = [self, *args]
@@ -25,31 +114,54 @@ class JSObject:
         return self._remote_call(function, args)
 
     def _remote_call(self, function, args):
-        # I think this is right, but having trouble figuring out exactly what all these IDs mean
+        self._check_context()
         args = self._convert_args(args)
-        execution_context_id = json.loads(self._object_id)['injectedScriptId']
+        # Calling the function on this object runs it in the object's own execution context
         response = self._page.session.send(
             'Runtime.callFunctionOn',
             functionDeclaration=function,
             arguments=args,
-            executionContextId=execution_context_id
+            objectId=self._object_id,
+            objectGroup=self._page._handles.group
         )
+        if 'exceptionDetails' in response:
+            raise PageError('Remote javascript call failed: %s' % response['exceptionDetails'])
 
+        return self._wrap_remote_object(response['result'])
+
+    def _wrap_remote_object(self, remote_object):
         # If the result is a primitive value return that
-        if 'value' in response['result']:
-            return response['result']['value']
+        if 'value' in remote_object:
+            return remote_object['value']
         # Or return an Element if it's a DOM node, or a generic object
         # TODO: Is there a smarter way to retun different types of objects?
-        elif response['result']['type'] == 'object':
-            if response['result'].get('subtype') == 'node':
-                return Element(response['result']['objectId'], response['result']['description'], self._page)
+        elif remote_object['type'] == 'object':
+            if remote_object.get('subtype') == 'node':
+                return Element(remote_object['objectId'], remote_object['description'], self._page, self._context_id)
             else:
-                return JSObject(response['result']['objectId'], response['result']['description'], self._page)
-        elif response['result']['type'] == 'undefined':
+                return JSObject(remote_object['objectId'], remote_object['description'], self._page, self._context_id)
+        elif remote_object['type'] == 'undefined':
             return None
         else:
             raise BrowserError('Unknown response from remote javascipt call')  # TODO: Find out if this can happen
 
+    def _check_context(self):
+        # Fail right away instead of waiting on the browser to reject a handle from a previous page
+        if not self._page._is_context_alive(self._context_id):
+            raise PageError('%r belongs to an execution context that no longer exists' % self)
+
+    def _items(self):
+        # Expand a remote array into a list with a single round trip, then release the array itself, and
+        # the properties that aren't items, such as its prototype
+        self._check_context()
+        response = self._page.session.send('Runtime.getProperties', objectId=self._object_id, ownProperties=True)
+        self.release()
+        items = [p for p in response['result'] if p['name'].isdigit() and 'value' in p]
+        items.sort(key=lambda p: int(p['name']))
+        self._page._handles.release(*[p['value']['objectId'] for p in response['result']
+                                      if not p['name'].isdigit() and 'objectId' in p.get('value', {})])
+        return [self._wrap_remote_object(p['value']) for p in items]
+
     def _convert_args(self, args):
         to_return = []
         for arg in args:
@@ -63,26 +175,28 @@ class JSObject:
 class Element(JSObject):
     '''A special kind of JSObject with extra helper methods'''
 
-    ORDERED_NODE_SNAPSHOT_TYPE = 7  # TODO: can get this code from JS?
-
     def xpath(self, expression):
-        xpath_result = self._page.document._method('evaluate', expression, self, None, self.ORDERED_NODE_SNAPSHOT_TYPE)
-        element_count = xpath_result._prop('snapshotLength')
-        results = []
-        for i in range(element_count):
-            results.append(xpath_result._method('snapshotItem', i))
-        return results
+        return ElementList(self._remote_call(XPATH_FUNCTION, [self, expression])._items(), self._page)
 
     def querySelector(self, selector):
         return self._method('querySelector', selector)
 
     def querySelectorAll(self, selector):
-        query_selector_all_result = self._method('querySelectorAll', selector)
-        length = query_selector_all_result._prop('length')
-        results = []
-        for i in range(length):
-            results.append(query_selector_all_result._method('item', i))
-        return results
+        return ElementList(self._remote_call(QUERY_SELECTOR_ALL_FUNCTION, [self, selector])._items(), self._page)
+
+    def extract(self, schema):
+        """Extract structured data from this element's subtree. See `Page.extract`."""
+        self._check_context()
+        response = self._page.session.send(
+            'Runtime.callFunctionOn',
+            functionDeclaration=EXTRACT_FUNCTION,
+            arguments=[{'objectId': self._object_id}, {'value': compile_schema(schema)}],
+            objectId=self._object_id,
+            returnByValue=True
+        )
+        if 'exceptionDetails' in response:
+            raise PageError('Extraction failed: %s' % response['exceptionDetails'])
+        return response['result']['value']
 
     @property
     def html(self):
@@ -96,13 +210,15 @@ class Element(JSObject):
         return self._method('focus')
 
     def click(self):
+        self._check_context()
         quads = self._page.session.send('DOM.getContentQuads', objectId=self._object_id)['quads'][0]
         mean_x = sum([quads[i] for i in range(0, len(quads), 2)]) / (len(quads) / 2)
         mean_y = sum([quads[i] for i in range(1, len(quads), 2)]) / (len(quads) / 2)
         # TODO: Move the mouse in natural steps
-        self._page.session.send('Input.dispatchMouseEvent', type='mouseMoved', x=mean_x, y=mean_y)
-        self._page.session.send('Input.dispatchMouseEvent', type='mousePressed', x=mean_x, y=mean_y, button='left', clickCount=1)
-        self._page.session.send('Input.dispatchMouseEvent', type='mouseReleased', x=mean_x, y=mean_y, button='left', clickCount=1)
+        with self._page.session.batch() as batch:
+            batch.send('Input.dispatchMouseEvent', type='mouseMoved', x=mean_x, y=mean_y)
+            batch.send('Input.dispatchMouseEvent', type='mousePressed', x=mean_x, y=mean_y, button='left', clickCount=1)
+            batch.send('Input.dispatchMouseEvent', type='mouseReleased', x=mean_x, y=mean_y, button='left', clickCount=1)
 
     @property
     def is_visible(self):
@@ -118,3 +234,59 @@ class Element(JSObject):
             [self]
         )
         return visibility != 'hidden' and has_visible_bounding_box
+
+
+class ElementList(list):
+    '''A list of Elements whose contents can be read in bulk. Each accessor runs one function over every
+    element in the page and returns plain values, so it costs a single round trip however long the list is.'''
+
+    def __init__(self, elements=(), page=None):
+        super().__init__(elements)
+        self._page = page
+
+    def texts(self):
+        return self.map_js('(element) => element.textContent')
+
+    def htmls(self):
+        return self.map_js('(element) => element.outerHTML')
+
+    def attrs(self, name):
+        return self.map_js('(element, name) => element.getAttribute(name)', name)
+
+    def props(self, *names):
+        """Read several properties of every element.
+
+        Returns:
+            A list with one dict per element, mapping each name to the element's property value.
+        """
+        return self.map_js(
+            '(element, ...names) => names.reduce((props, name) => { props[name] = element[name]; return props; }, {})',
+            *names
+        )
+
+    def map_js(self, function, *args):
+        """Apply a javascript function to every element.
+
+        Args:
+            function (str): A function taking an element, followed by `args`, e.g. `(element) => element.href`.
+            *args: Extra JSON-serializable arguments passed to the function.
+
+        Returns:
+            A list with the function's return value for each element, serialized by value.
+
+        Raises:
+            PageError: If the function throws.
+        """
+        if not self:
+            return []
+        self[0]._check_context()
+        response = self._page.session.send(
+            'Runtime.callFunctionOn',
+            functionDeclaration=MAP_FUNCTION.format(function=function),
+            arguments=[{'value': len(args)}] + [{'value': arg} for arg in args] + [{'objectId': e._object_id} for e in self],
+            objectId=self[0]._object_id,
+            returnByValue=True
+        )
+        if 'exceptionDetails' in response:
+            raise PageError('Mapping `%s` over the elements failed: %s' % (function, response['exceptionDetails']))
+        return response['result']['value']
@@ -23,15 +23,13 @@ class LifecycleWatcher:
         self._page = page
         self._wait_until = wait_until if isinstance(wait_until, list) else [wait_until]
         self._require_new_loader = require_new_loader
-        self._session = self._page.create_devtools_session()
         self._initial_loader_id = page.loader_id
         self._loader_id = None
         self._lifecycle_events = set()
         self._lifecycle_complete_event = Event()
 
-        self._session.send('Page.enable')
-        self._session.send('Page.setLifecycleEventsEnabled', enabled=True)
-        self._session.on('Page.lifecycleEvent', self._on_lifecycle_event)
+        # The page's session already has lifecycle events enabled, so listening costs no round trips
+        self._subscription = self._page.session.on('Page.lifecycleEvent', self._on_lifecycle_event)
 
     def _on_lifecycle_event(self, loaderId, name, **kwargs):
         if name == 'init':
@@ -50,5 +48,12 @@ class LifecycleWatcher:
         return True
 
     def wait(self, timeout):
-        if not self._lifecycle_complete_event.wait(timeout=timeout):
-            raise PageError('Navigation not completed after %s seconds.' % timeout)
+        try:
+            if not self._lifecycle_complete_event.wait(timeout=timeout):
+                raise PageError('Navigation not completed after %s seconds.' % timeout)
+        finally:
+            self.cancel()
+
+    def cancel(self):
+        """Stop listening for lifecycle events."""
+        self._subscription.unsubscribe()
@@ -1,43 +1,74 @@
+import json
 import time
 
 from contextlib import contextmanager
+from urllib.parse import urlparse
 
 from .exceptions import BrowserError, PageError
-from .js_object import Element
+from .extract import extract_expression
+from .handle_registry import DEFAULT_OBJECT_GROUP, HandleRegistry
+from .js_object import Element, ElementList, JSObject, QUERY_SELECTOR_ALL_FUNCTION, WAIT_FOR_FUNCTION, XPATH_FUNCTION
 from .lifecycle_watcher import LifecycleWatcher
 from .request import Request
 from .request_manager import RequestManager
 from .response import Response
 
 
+# Errors a command evaluating in the page gets when a navigation tears down its execution context
+CONTEXT_DESTROYED_ERRORS = (
+    'Execution context was destroyed',
+    'Inspected target navigated or closed',
+    'Cannot find context with specified id',
+)
+
+
+def _is_context_destroyed(error):
+    details = error.args[0] if error.args else None
+    message = details.get('message', '') if isinstance(details, dict) else str(details)
+    return message.startswith(CONTEXT_DESTROYED_ERRORS)
+
+
 class Page:
-    def __init__(self, connection, target_id, proxy_uri=None):
+    def __init__(self, connection, target_id, proxy_uri=None, browser_context_id=None):
         self._proxy_uri = proxy_uri
         self._target_id = target_id
         self._connection = connection
-        self._request_manager = RequestManager(self, self._proxy_uri)
+        # None for the browser's default context
+        self._browser_context_id = browser_context_id
 
         self.closed = False
 
         self._requests_by_url = {}
         self._requests_by_id = {}
-        self._frames = {}
 
         self._loader_id = None
         self._frame_id = None
         self._navigation_url = None
 
+        # Execution contexts by id, mapped to their frame id, and the main world context of each frame
+        self._contexts = {}
+        self._main_world_contexts = {}
+        self._document = None
+
         self.session = self.create_devtools_session()
+        self._handles = HandleRegistry(self.session)
+        self._request_manager = RequestManager(self, self._proxy_uri)
 
-        self.session.send('Network.enable', enabled=True)
         self.session.on('Network.requestWillBeSent', self._on_request_will_be_sent)
         self.session.on('Network.responseReceived', self._on_response_recieved)
-
-        self.session.send('Page.enable', enabled=True)
-        self.session.send('Page.setLifecycleEventsEnabled', enabled=True)
         self.session.on('Page.lifecycleEvent', self._on_lifecycle_event)
-
         self.session.on('Page.frameNavigated', self._on_frame_navigated)
+        self.session.on('Runtime.executionContextCreated', self._on_execution_context_created)
+        self.session.on('Runtime.executionContextDestroyed', self._on_execution_context_destroyed)
+        self.session.on('Runtime.executionContextsCleared', self._on_execution_contexts_cleared)
+
+        with self.session.batch() as batch:
+            batch.send('Network.enable', enabled=True)
+            batch.send('Page.enable', enabled=True)
+            batch.send('Page.setLifecycleEventsEnabled', enabled=True)
+            frame_tree = batch.send('Page.getFrameTree')
+            batch.send('Runtime.enable')
+        self._frame_id = self._frame_id or frame_tree.result()['frameTree']['frame']['id']
 
     # Public API #
 
@@ -67,6 +98,8 @@ class Page:
             return
         self.closed = True
         response = self._connection.send('Target.closeTarget', targetId=self._target_id)
+        self._request_manager.close()
+        self.session.close()
         if not response['success']:
             raise BrowserError('Could not close page')
 
@@ -84,9 +117,21 @@ class Page:
 
     @property
     def document(self):
-        """An Element representing the current page's `document` object."""
-        response = self.evaluate('document')
-        return Element(response['objectId'], response['description'], self)
+        """An Element representing the current page's `document` object. The handle is cached until the
+        page navigates."""
+        document = self._document
+        if document is None or not self._is_context_alive(document._context_id):
+            # Read the context first: the document can only belong to it or to a newer one, which would
+            # just make the cached handle expire early. The handle is kept out of any `handle_scope`, which
+            # would release it while it's still cached.
+            context_id = self._main_context_id
+            response = self.session.send('Runtime.evaluate', expression='document', objectGroup=DEFAULT_OBJECT_GROUP)
+            result = response['result']
+            document = Element(result['objectId'], result['description'], self, context_id, DEFAULT_OBJECT_GROUP)
+            # Until the page learned about its contexts, there is no telling when the handle goes stale
+            if context_id is not None:
+                self._document = document
+        return document
 
     def evaluate(self, expression):
         """Send an expression to be evaluated in the browser's JavaScript console.
@@ -99,7 +144,7 @@ class Page:
            if the remote code returns a primitive type, or a dict describing a remote object if
            the code returns a complex type.
         """
-        response = self.session.send('Runtime.evaluate', expression=expression)
+        response = self.session.send('Runtime.evaluate', expression=expression, objectGroup=self._handles.group)
         if 'value' in response['result']:
             return response['result']['value']
         else:
@@ -116,6 +161,27 @@ class Page:
         """
         self.session.send('Page.addScriptToEvaluateOnNewDocument', source=script)
 
+    @contextmanager
+    def handle_scope(self):
+        """A context manager releasing every remote object handle created inside it when it exits, so that
+        long-lived pages don't accumulate objects in their javascript heap:
+
+           ```
+           with page.handle_scope():
+               rows = page.xpath('//tr')
+               texts = rows.texts()
+           ```
+
+        Elements created inside the scope can't be used after it exits.
+        """
+        with self._handles.scope():
+            yield
+
+    @property
+    def live_handles(self):
+        """The number of remote objects this page's handles currently keep alive in the browser."""
+        return self._handles.live
+
     # TODO: implement referer
     def goto(self,
              url,
@@ -132,11 +198,58 @@ class Page:
             The response recieved for the navigation request.
         """
         lifecyle_watcher = LifecycleWatcher(self, wait_until)
-        self.session.send('Page.navigate', url=url)
+        try:
+            self.session.send('Page.navigate', url=url)
+        except BaseException:
+            lifecyle_watcher.cancel()
+            raise
         lifecyle_watcher.wait(timeout)
         if self._navigation_url in self._requests_by_url:
             return self._requests_by_url[self._navigation_url].response
 
+    def extract(self, schema):
+        """Extract structured data from the page with a single round trip.
+
+        The whole schema is compiled into one javascript function that runs in the page and returns plain
+        values, which makes this much faster than walking elements with `xpath` and reading their properties.
+
+        ```
+        page.extract({
+            'title': 'h1',
+            'products': [{
+                'selector': 'li.product',
+                'fields': {
+                    'name': '.name',
+                    'url': 'a @href',
+                    'price': './/span[@class="price"] ::text',
+                },
+            }],
+        })
+        ```
+
+        Args:
+            schema (dict): Maps output names to fields. A field is either
+                - a string: `'<selector>'` for the text of the first match, `'<selector> @<attribute>'`
+                  for an attribute, or `'<selector> ::text'`, `'<selector> ::html'` or
+                  `'<selector> ::prop(<name>)'`. Leaving out the selector (`'@href'`) reads the node the
+                  field is applied to. Selectors starting with `/`, `./`, `..`, `(`, a step such as `*//`
+                  or `td[2]/`, or an axis such as `descendant::` are xpath, anything else is CSS.
+                - a dict with a `selector` (CSS) or `xpath` key and optionally one of `attr`, `prop`,
+                  `html=True` or `fields`, a nested schema extracted from the matched node.
+                - a one-item list wrapping either of the above, to extract every match instead of the first.
+
+        Returns:
+            A dict shaped like the schema. Fields without a match are None, or an empty list.
+
+        Raises:
+            ValueError: If the schema is malformed.
+            PageError: If the extraction fails in the page.
+        """
+        response = self.session.send('Runtime.evaluate', expression=extract_expression(schema), returnByValue=True)
+        if 'exceptionDetails' in response:
+            raise PageError('Extraction failed: %s' % response['exceptionDetails'])
+        return response['result']['value']
+
     def focus(self, xpath_expression):
         """Focus an element on the page.
 
@@ -165,6 +278,29 @@ class Page:
         """All the requests this page has made."""
         return list(self._requests_by_url.values())
 
+    def reset(self, timeout=30):
+        """Return the page to a blank state: navigate to about:blank, clear the cookies of the page's browser
+        context and the storage of every origin the page has made requests to, and forget its request history.
+        Other pages of the same browser context lose their cookies too; pages of other contexts are unaffected.
+
+        Args:
+            timeout (int, optional): Maximum number of seconds to wait for the navigation. Defaults to 30.
+        """
+        origins = set()
+        for url in self._requests_by_url:
+            parsed_url = urlparse(url)
+            if parsed_url.scheme in ('http', 'https'):
+                origins.add('{}://{}'.format(parsed_url.scheme, parsed_url.netloc))
+        self.goto('about:blank', timeout=timeout)
+        clear_cookies = {} if self._browser_context_id is None else {'browserContextId': self._browser_context_id}
+        cleared_cookies = self._connection.send_async('Storage.clearCookies', **clear_cookies)
+        with self.session.batch() as batch:
+            for origin in origins:
+                batch.send('Storage.clearDataForOrigin', origin=origin, storageTypes='all')
+        self._connection.wait(cleared_cookies)
+        self._requests_by_url.clear()
+        self._requests_by_id.clear()
+
     def select(self, selector):
         """Search the current page for elements matching a CSS selector.
 
@@ -172,9 +308,13 @@ class Page:
             selector (str): The CSS selector expression to search for.
 
         Returns:
-            A list of Element objects representing the HTML nodes found on the page.
+            An ElementList of Element objects representing the HTML nodes found on the page. Its `texts()`,
+            `attrs()`, `props()` and `map_js()` read every element in a single round trip.
+
+        Raises:
+            PageError: If the selector is invalid.
         """
-        return self.document.querySelectorAll(selector)
+        return self._evaluate_items(QUERY_SELECTOR_ALL_FUNCTION, selector)
 
     def type(self, xpath_expression, text, delay=0):
         """Give an element focus, then simulate a series of keyboard events.
@@ -218,12 +358,37 @@ class Page:
             timeout (int, optional): Maximum number of seconds to wait for the navigation to finish. Defaults to 30.
         """
         lifecycle_watcher = LifecycleWatcher(self, wait_until, False)
-        yield
+        try:
+            yield
+        except BaseException:
+            lifecycle_watcher.cancel()
+            raise
         lifecycle_watcher.wait(timeout)
 
+    def wait_for_selector(self, selector, visible=False, timeout=30):
+        """Pause execution until an element matching a CSS selector is present on the page.
+
+        Args:
+            selector (str): The CSS selector to wait for. When at least one matching element is
+                found, waiting will end.
+            visible (bool, optional): If True, don't match elements that have `display: none` or
+                `visibility: hidden` CSS properties.
+            timeout (int, optional): The number of seconds to wait before throwing an error.
+
+        Returns:
+            An ElementList of elements matching the selector.
+
+        Raises:
+            PageError: If no matching element is found before the given timeout.
+        """
+        return self._wait_for('selector', selector, visible, timeout)
+
     def wait_for_xpath(self, xpath_expr, visible=False, timeout=30):
         """Pause execution until an element is present on the page.
 
+        The waiting happens inside the page, which reacts to DOM changes as they happen, so this only costs
+        a couple of round trips however long it waits.
+
         Args:
             xpath_expression (str): The xpath expression to wait for. When at least one matching element is
                 found, waiting will end.
@@ -232,26 +397,12 @@ class Page:
             timeout (int, optional): The number of seconds to wait before throwing an error.
 
         Returns:
-            A list of elements matching the xpath expression.
+            An ElementList of elements matching the xpath expression.
 
         Raises:
             PageError: If no matching element is found before the given timeout.
         """
-        slept = 0.0
-        interval = 0.1
-        element_list = []
-        while slept < timeout:
-            element_list = self.xpath(xpath_expr)
-            if element_list:
-                if visible:
-                    visible_elements = [e for e in element_list if e.is_visible]
-                    if len(visible_elements):
-                        return visible_elements
-                else:
-                    return element_list
-            time.sleep(interval)
-            slept += interval
-        raise PageError('Timed out waiting for element at `%s`' % xpath_expr)
+        return self._wait_for('xpath', xpath_expr, visible, timeout)
 
     def xpath(self, expression):
         """Search the current page for elements matching an xpath expression.
@@ -260,17 +411,110 @@ class Page:
             expression (str): The xpath expression to search for.
 
         Returns:
-            A list of Element objects representing the HTML nodes found on the page.
+            An ElementList of Element objects representing the HTML nodes found on the page. Its `texts()`,
+            `attrs()`, `props()` and `map_js()` read every element in a single round trip.
+
+        Raises:
+            PageError: If the xpath expression is invalid.
         """
-        return self.document.xpath(expression)
+        return self._evaluate_items(XPATH_FUNCTION, expression)
 
     def blacklist_url_patterns(self, *args):
         self._request_manager.blacklist_url_patterns(*args)
 
+    def blacklist_url_rules(self, *rules):
+        """Block requests matching adblock filter rules, e.g. `||ads.example.com^`; see `UrlMatcher.add_rules`."""
+        self._request_manager.blacklist_url_rules(*rules)
+
+    def load_url_blacklist(self, path):
+        """Block requests matching the adblock filter rules in a file, one per line."""
+        self._request_manager.load_url_blacklist(path)
+
+    def interception_stats(self):
+        """Counts of the requests paused and blocked by this page's interception, and of the replies to
+        Chrome that failed, along with the last such error."""
+        return self._request_manager.stats()
+
+    @property
+    def url_blacklist(self):
+        """The UrlMatcher deciding which requests are blocked. Its `hits` count the requests each rule blocked.
+
+        A matcher can be shared by many pages, so a large blacklist is only compiled once:
+
+           ```
+           matcher = UrlMatcher()
+           matcher.load('easylist.txt')
+           for page in pages:
+               page.url_blacklist = matcher
+           ```
+        """
+        return self._request_manager.url_matcher
+
+    @url_blacklist.setter
+    def url_blacklist(self, url_matcher):
+        self._request_manager.set_url_matcher(url_matcher)
+
+    def stream_response_bodies(self, *url_patterns):
+        """Have the bodies of responses whose url contains one of `url_patterns` read incrementally, with
+        `Response.stream` or `Response.save`, instead of in one piece. Meant for large downloads: Chrome
+        hands such a body over to be read and the page itself never receives it. The request stays pending
+        until its body is read, or dropped with `Response.close`.
+        """
+        self._request_manager.stream_response_bodies(*url_patterns)
+
+    @property
+    def response_cache(self):
+        """The ResponseCache serving this page's static assets, None by default. Set it to a cache to have
+        matching requests answered from disk and new responses stored; set it to None to stop."""
+        return self._request_manager.response_cache
+
+    @response_cache.setter
+    def response_cache(self, response_cache):
+        self._request_manager.set_response_cache(response_cache)
+
     def blacklist_resource_types(self, *args):
         self._request_manager.blacklist_resource_types(*args)
 
     # Private methods
+    def _wait_for(self, kind, selector, visible, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise PageError('Timed out waiting for element at `%s`' % selector)
+            expression = '({})({}, {}, {}, {})'.format(
+                WAIT_FOR_FUNCTION, json.dumps(kind), json.dumps(selector), json.dumps(visible), int(remaining * 1000)
+            )
+            try:
+                response = self.session.send('Runtime.evaluate',
+                                             _timeout=remaining + 5,
+                                             expression=expression,
+                                             awaitPromise=True,
+                                             objectGroup=self._handles.group)
+            except BrowserError as e:
+                # A navigation destroyed the context the promise was waiting in; wait again in the new one
+                if _is_context_destroyed(e):
+                    time.sleep(0.01)
+                    continue
+                raise
+            if 'exceptionDetails' in response:
+                raise PageError('Waiting for `%s` failed: %s' % (selector, response['exceptionDetails']))
+            result = response['result']
+            if result.get('subtype') == 'null':
+                raise PageError('Timed out waiting for element at `%s`' % selector)
+            return ElementList(JSObject(result['objectId'], result['description'], self)._items(), self)
+
+    def _evaluate_items(self, function, argument):
+        # Call a function returning an array on the document and expand it, in two round trips total
+        response = self.session.send('Runtime.evaluate',
+                                     expression='({})(document, {})'.format(function, json.dumps(argument)),
+                                     objectGroup=self._handles.group)
+        if 'exceptionDetails' in response:
+            # e.g. an invalid xpath or selector, which would otherwise look like no matches
+            raise PageError('Evaluating `%s` failed: %s' % (argument, response['exceptionDetails']))
+        result = response['result']
+        return ElementList(JSObject(result['objectId'], result['description'], self)._items(), self)
+
     def _on_request_will_be_sent(self, **kwargs):
         request = Request(kwargs['request'], kwargs['requestId'])
         self._requests_by_id[request.request_id] = request
@@ -279,10 +523,28 @@ class Page:
     def _on_response_recieved(self, **kwargs):
         request_id = kwargs['requestId']
         request = self._requests_by_id.get(request_id)
-        if request is not None:
+        if request is not None and not (request.response is not None and request.response.streamed):
             response = Response(kwargs['response'], request, self)
             request.set_response(response)
 
+    def _on_response_stream(self, kwargs, stream, on_stream_closed):
+        # A response paused by the request manager, whose body was handed over as an IO stream
+        request = self._requests_by_id.get(kwargs.get('networkId'))
+        if request is None:
+            request = Request(kwargs['request'], kwargs.get('networkId'))
+            self._requests_by_id[request.request_id] = request
+            self._requests_by_url[request.url] = request
+        headers = {header['name']: header['value'] for header in kwargs.get('responseHeaders', [])}
+        content_type = next((value for name, value in headers.items() if name.lower() == 'content-type'), '')
+        response_data = {
+            'url': request.url,
+            'status': kwargs['responseStatusCode'],
+            'statusText': kwargs.get('responseStatusText', ''),
+            'headers': headers,
+            'mimeType': content_type.split(';')[0].strip(),
+        }
+        request.set_response(Response(response_data, request, self, stream=stream, on_stream_closed=on_stream_closed))
+
     @property
     def loader_id(self):
         return self._loader_id
@@ -292,7 +554,36 @@ class Page:
             self._loader_id = kwargs['loaderId']
 
     def _on_frame_navigated(self, **kwargs):
-        is_main_frame = not bool(kwargs.get('parentId'))
+        is_main_frame = not bool(kwargs['frame'].get('parentId'))
         if is_main_frame:
             self._frame_id = kwargs['frame']['id']
             self._navigation_url = kwargs['frame']['url']
+            self._document = None
+
+    @property
+    def _main_context_id(self):
+        return self._main_world_contexts.get(self._frame_id)
+
+    def _is_context_alive(self, context_id):
+        # Handles created before the page learned about any context can't be checked
+        return context_id is None or context_id in self._contexts
+
+    def _on_execution_context_created(self, context, **kwargs):
+        aux_data = context.get('auxData', {})
+        self._contexts[context['id']] = aux_data.get('frameId')
+        if aux_data.get('isDefault') and aux_data.get('frameId'):
+            self._main_world_contexts[aux_data['frameId']] = context['id']
+
+    def _on_execution_context_destroyed(self, executionContextId, **kwargs):
+        frame_id = self._contexts.pop(executionContextId, None)
+        if self._main_world_contexts.get(frame_id) == executionContextId:
+            del self._main_world_contexts[frame_id]
+        if self._document is not None and self._document._context_id == executionContextId:
+            self._document = None
+
+    def _on_execution_contexts_cleared(self, **kwargs):
+        self._contexts.clear()
+        self._main_world_contexts.clear()
+        self._document = None
+        # The page's javascript heap went away, and every remote object with it
+        self._handles.clear()
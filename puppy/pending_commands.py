@@ -0,0 +1,131 @@
+import heapq
+import time
+
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from threading import RLock
+
+from .exceptions import BrowserError
+
+
+MESSAGE_TIMEOUT = 300
+
+
+class PendingCommands:
+    '''The commands a `Connection` or `Session` is waiting on, keyed by message id.
+
+    An entry only lives until its future is done: resolved by the browser's reply, failed, cancelled or
+    expired past its deadline. Expired entries are swept whenever a new command is added, so commands
+    whose caller never waits on them can't pile up either.
+    '''
+
+    def __init__(self, default_timeout=MESSAGE_TIMEOUT):
+        self.default_timeout = default_timeout
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.cancelled = 0
+
+        self._futures = {}
+        self._deadlines = []
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._futures)
+
+    @property
+    def in_flight(self):
+        return len(self._futures)
+
+    def stats(self):
+        return {
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'failed': self.failed,
+            'timed_out': self.timed_out,
+            'cancelled': self.cancelled,
+        }
+
+    def add(self, message_id, timeout=None):
+        """Register a command and return the future its reply will resolve.
+
+        Args:
+            message_id (int): The id the command is sent with.
+            timeout (float, optional): Seconds until the command expires. Defaults to `default_timeout`.
+        """
+        self._expire_overdue()
+        future = Future()
+        future.message_id = message_id
+        future.deadline = time.monotonic() + (self.default_timeout if timeout is None else timeout)
+        with self._lock:
+            self._futures[message_id] = future
+            heapq.heappush(self._deadlines, (future.deadline, message_id))
+            # Deadlines of completed commands stay in the heap until they pass; compact it when they dominate
+            if len(self._deadlines) > 2 * len(self._futures) + 64:
+                self._deadlines = [(f.deadline, id_) for id_, f in self._futures.items()]
+                heapq.heapify(self._deadlines)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def resolve(self, message):
+        """Complete a command from the browser's reply. Replies to unknown or expired commands are dropped."""
+        future = self._futures.get(message['id'])
+        if future is None:
+            return
+        if 'error' in message:
+            if self._set(future, exception=BrowserError(message['error'])):
+                self.failed += 1
+        elif self._set(future, result=message.get('result')):
+            self.completed += 1
+
+    def fail(self, message_id, exc):
+        future = self._futures.get(message_id)
+        if future is not None and self._set(future, exception=exc):
+            self.failed += 1
+
+    def wait(self, future):
+        """Block until a command completes, expiring it if its deadline passes first."""
+        try:
+            return future.result(timeout=max(future.deadline - time.monotonic(), 0))
+        except FutureTimeoutError:
+            self.expire(future.message_id)
+            return future.result()
+
+    def expire(self, message_id):
+        future = self._futures.get(message_id)
+        if future is not None and self._set(future, exception=BrowserError('Timed out waiting for response from browser')):
+            self.timed_out += 1
+
+    def cancel_all(self, exc):
+        """Fail every in-flight command, e.g. because its session or page was closed."""
+        with self._lock:
+            futures = list(self._futures.values())
+        for future in futures:
+            if self._set(future, exception=exc):
+                self.cancelled += 1
+
+    def _set(self, future, result=None, exception=None):
+        # The reader thread and an expiring waiter may race to complete the same future. Done callbacks
+        # run inside set_result/set_exception on this thread, hence the reentrant lock.
+        with self._lock:
+            if future.done():
+                return False
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+            return True
+
+    def _on_done(self, future):
+        with self._lock:
+            self._futures.pop(future.message_id, None)
+        if future.cancelled():
+            self.cancelled += 1
+
+    def _expire_overdue(self):
+        now = time.monotonic()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            with self._lock:
+                if not self._deadlines or self._deadlines[0][0] > now:
+                    break
+                _, message_id = heapq.heappop(self._deadlines)
+            self.expire(message_id)
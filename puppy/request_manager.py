@@ -1,7 +1,33 @@
+import asyncio
+import base64
+import re
+
 from urllib.parse import urlparse
 
+from .exceptions import BrowserError
+from .response import decode_body
+from .url_matcher import UrlMatcher
+
+
+# Beyond this many url patterns, Chrome is asked to pause every request and the patterns are matched here
+MAX_PUSHED_URL_PATTERNS = 64
+
+
+def _url_glob(url_pattern):
+    # Blacklisted url patterns are substrings; Fetch patterns are globs where `*`, `?` and `\` are special
+    return '*{}*'.format(re.sub(r'([*?\\])', r'\\\1', url_pattern))
+
 
 class RequestManager:
+    '''Blocks requests and answers proxy authentication challenges for a page, with the Fetch domain.
+
+    Only what can actually be acted on is intercepted: the blacklisted resource types and url patterns are
+    handed to Chrome as `Fetch.enable` patterns, so every other request goes through without pausing. When
+    nothing is configured, interception is off entirely. Proxy credentials, large blacklists and adblock
+    rules are the exception: every request is paused and matched against the compiled `UrlMatcher`, as
+    Chrome only reports authentication challenges for requests it paused.
+    '''
+
     def __init__(self, page, proxy_uri):
         self._page = page
         self._proxy_uri = proxy_uri
@@ -10,35 +36,281 @@ class RequestManager:
         self._proxy_password = parsed_proxy_uri.password
         self._blacklisted_url_patterns = []
         self._blacklisted_resource_types = []
-        self._session = self._page.create_devtools_session()
-        self._session.send('Network.setRequestInterception', patterns=[{'urlPattern': '*'}])
-        self._session.on('Network.requestIntercepted', self._on_request_intercepted)
+        self._interception_patterns = []
+        self.url_matcher = UrlMatcher()
+        self.response_cache = None
+        self._stream_url_patterns = []
+        self._reset_stats()
+        self._session = self._page.session
+        self._session.on('Fetch.requestPaused', self._on_request_paused)
+        self._session.on('Fetch.authRequired', self._on_auth_required)
+        self._update_interception()
 
-    def blacklist_urls(self, *args):
-        self._blacklisted_url_patterns.extend(args)
+    def blacklist_url_patterns(self, *args):
+        self._add_url_patterns(args)
+        self._update_interception()
+
+    def blacklist_url_rules(self, *rules):
+        self.url_matcher.add_rules(*rules)
+        self._update_interception()
+
+    def load_url_blacklist(self, path):
+        self.url_matcher.load(path)
+        self._update_interception()
+
+    def set_url_matcher(self, url_matcher):
+        self._blacklisted_url_patterns = []
+        self.url_matcher = url_matcher
+        self._update_interception()
 
     def blacklist_resource_types(self, *args):
         self._blacklisted_resource_types.extend(args)
+        self._update_interception()
+
+    def stream_response_bodies(self, *url_patterns):
+        self._stream_url_patterns.extend(url_patterns)
+        self._update_interception()
+
+    def set_response_cache(self, response_cache):
+        self.response_cache = response_cache
+        self._update_interception()
+
+    def stats(self):
+        return {
+            'paused': self._paused,
+            'blocked': self._blocked,
+            'fulfilled_from_cache': self._fulfilled,
+            'reply_errors': self._reply_errors,
+            'last_reply_error': self._last_reply_error,
+        }
+
+    def close(self):
+        self._session.off('Fetch.requestPaused', self._on_request_paused)
+        self._session.off('Fetch.authRequired', self._on_auth_required)
 
-    def _on_request_intercepted(self, **kwargs):
-        interception_id = kwargs.get('interceptionId')
-        if kwargs.get('authChallenge'):
-            self._session.send('Network.continueInterceptedRequest',
-                               interceptionId=interception_id,
-                               authChallengeResponse={
-                                   'response': 'ProvideCredentials',
-                                   'username': self._proxy_username,
-                                   'password': self._proxy_password
-                               })
+    def _update_interception(self):
+        command = self._interception_command()
+        if command is not None:
+            self._session.send(command[0], **command[1])
+
+    def _interception_command(self):
+        # The Fetch command bringing interception in line with the configuration, if it changed
+        patterns = self._build_interception_patterns()
+        if patterns == self._interception_patterns:
+            return None
+        self._interception_patterns = patterns
+        if not patterns:
+            return 'Fetch.disable', {}
+        return 'Fetch.enable', {'patterns': patterns, 'handleAuthRequests': self._has_proxy_credentials}
+
+    def _add_url_patterns(self, url_patterns):
+        self._blacklisted_url_patterns.extend(url_patterns)
+        self.url_matcher.add_substrings(*url_patterns)
+
+    def _build_interception_patterns(self):
+        patterns = self._build_blocking_patterns()
+        if self.response_cache is not None:
+            # Cacheable requests pause twice: before being sent, to be answered from the cache, and once
+            # their response arrived, to be stored
+            for resource_type in self.response_cache.resource_types:
+                patterns.append({'urlPattern': '*', 'resourceType': resource_type, 'requestStage': 'Request'})
+                patterns.append({'urlPattern': '*', 'resourceType': resource_type, 'requestStage': 'Response'})
+        patterns.extend({'urlPattern': _url_glob(url_pattern), 'requestStage': 'Response'} for url_pattern in self._stream_url_patterns)
+        return patterns
+
+    def _build_blocking_patterns(self):
+        # Only plain substrings translate to Fetch patterns; a shared matcher's rules are unknown here
+        pushable = self.url_matcher.substrings_only and len(self.url_matcher) == len(set(self._blacklisted_url_patterns))
+        if self._has_proxy_credentials or not pushable or len(self._blacklisted_url_patterns) > MAX_PUSHED_URL_PATTERNS:
+            return [{'urlPattern': '*'}]
+        patterns = [{'urlPattern': '*', 'resourceType': resource_type} for resource_type in self._blacklisted_resource_types]
+        patterns.extend({'urlPattern': _url_glob(url_pattern)} for url_pattern in self._blacklisted_url_patterns)
+        return patterns
+
+    @property
+    def _has_proxy_credentials(self):
+        return self._proxy_username is not None
+
+    def _is_blocked(self, resource_type, url):
+        if resource_type in self._blacklisted_resource_types:
+            return True
+        return self.url_matcher.match(url, resource_type) is not None
+
+    def _reset_stats(self):
+        self._paused = 0
+        self._blocked = 0
+        self._fulfilled = 0
+        self._reply_errors = 0
+        self._last_reply_error = None
+
+    def _paused_request_command(self, kwargs):
+        request_id = kwargs['requestId']
+        self._paused += 1
+        if self._is_blocked(kwargs.get('resourceType'), kwargs.get('request', {}).get('url', '')):
+            self._blocked += 1
+            return 'Fetch.failRequest', {'requestId': request_id, 'errorReason': 'Aborted'}
+        return 'Fetch.continueRequest', {'requestId': request_id}
+
+    def _auth_required_command(self, kwargs):
+        if kwargs['authChallenge'].get('source') == 'Proxy' and self._has_proxy_credentials:
+            response = {'response': 'ProvideCredentials', 'username': self._proxy_username, 'password': self._proxy_password}
+        else:
+            response = {'response': 'Default'}
+        return 'Fetch.continueWithAuth', {'requestId': kwargs['requestId'], 'authChallengeResponse': response}
+
+    def _on_request_paused(self, **kwargs):
+        if 'responseStatusCode' in kwargs or 'responseErrorReason' in kwargs:
+            self._on_response_paused(kwargs)
+            return
+        method, params = self._paused_request_command(kwargs)
+        if method == 'Fetch.continueRequest' and self._is_cacheable(kwargs):
+            # The lookup reads from disk, which mustn't hold up the page's other events. Should it fail to even
+            # start, e.g. because the cache was closed, the request goes to the network rather than staying paused.
+            try:
+                future = self.response_cache.get_async(kwargs['request']['url'], kwargs['request'].get('headers', {}))
+            except Exception:
+                self._reply('Fetch.continueRequest', {'requestId': kwargs['requestId']})
+                return
+            future.add_done_callback(lambda future: self._on_cache_lookup(kwargs, future))
             return
+        self._reply(method, params)
 
-        if kwargs.get('resourceType') in self._blacklisted_resource_types:
-            self._session.send('Network.continueInterceptedRequest', interceptionId=interception_id, errorReason='Aborted')
+    def _on_cache_lookup(self, kwargs, future):
+        cached = None if future.cancelled() or future.exception() is not None else future.result()
+        if cached is None:
+            self._reply('Fetch.continueRequest', {'requestId': kwargs['requestId']})
             return
+        self._fulfilled += 1
+        self._reply('Fetch.fulfillRequest', {
+            'requestId': kwargs['requestId'],
+            'responseCode': cached.status,
+            'responseHeaders': cached.headers,
+            'body': base64.b64encode(cached.body).decode(),
+        })
 
-        for url_pattern in self._blacklisted_url_patterns:
-            if url_pattern in kwargs.get('request', {}).get('url', ''):
-                self._session.send('Network.continueInterceptedRequest', interceptionId=interception_id, errorReason='Aborted')
+    def _is_cacheable(self, kwargs):
+        return self.response_cache is not None and self.response_cache.is_cacheable_request(kwargs['request'], kwargs.get('resourceType'))
+
+    def _on_response_paused(self, kwargs):
+        request_id = kwargs['requestId']
+        if self._is_streamed(kwargs):
+            try:
+                future = self._session.send_async('Fetch.takeResponseBodyAsStream', requestId=request_id)
+            except BrowserError as e:
+                self._on_reply_failed(e)
                 return
+            future.add_done_callback(lambda future: self._session.post(self._on_response_stream, kwargs, future))
+            return
+        if kwargs.get('responseStatusCode') != 200 or not self._is_cacheable(kwargs):
+            self._reply('Fetch.continueRequest', {'requestId': request_id})
+            return
+        try:
+            future = self._session.send_async('Fetch.getResponseBody', requestId=request_id)
+        except BrowserError as e:
+            self._on_reply_failed(e)
+            return
+        # Decoding and storing the body mustn't happen on the thread receiving the browser's messages
+        future.add_done_callback(lambda future: self._session.post(self._on_response_body, kwargs, future))
+
+    def _is_streamed(self, kwargs):
+        if 'responseErrorReason' in kwargs or 300 <= kwargs.get('responseStatusCode', 0) < 400:
+            return False
+        url = kwargs['request']['url']
+        return any(url_pattern in url for url_pattern in self._stream_url_patterns)
+
+    def _on_response_stream(self, kwargs, future):
+        if future.cancelled() or future.exception() is not None:
+            self._reply('Fetch.continueRequest', {'requestId': kwargs['requestId']})
+            return
+        # Once its body is taken, a request can only be failed or fulfilled, and the page itself never gets
+        # it. Failing it ends the load, so that waits until the body was read or dropped.
+        fail = {'requestId': kwargs['requestId'], 'errorReason': 'Aborted'}
+        self._page._on_response_stream(kwargs, future.result()['stream'], lambda: self._reply('Fetch.failRequest', fail))
+
+    def _on_response_body(self, kwargs, future):
+        # Release the response first; storing it happens in the background anyway
+        self._reply('Fetch.continueRequest', {'requestId': kwargs['requestId']})
+        if future.cancelled() or future.exception() is not None:
+            return
+        request = kwargs['request']
+        self.response_cache.put(request['url'],
+                                request.get('headers', {}),
+                                kwargs['responseStatusCode'],
+                                kwargs.get('responseHeaders', []),
+                                decode_body(future.result()))
+
+    def _on_auth_required(self, **kwargs):
+        self._reply(*self._auth_required_command(kwargs))
+
+    def _reply(self, method, params):
+        # Never wait for the reply: the page's other paused requests are queued behind this handler
+        try:
+            future = self._session.send_async(method, **params)
+        except BrowserError as e:
+            self._on_reply_failed(e)
+            return
+        future.add_done_callback(self._on_reply_done)
+
+    def _on_reply_done(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            self._on_reply_failed(future.exception())
+
+    def _on_reply_failed(self, error):
+        # Usually harmless, e.g. the request was cancelled or the page closed in the meantime
+        self._reply_errors += 1
+        self._last_reply_error = error
+
+
+class AsyncRequestManager(RequestManager):
+    '''Request interception for an `AsyncPage`; `enable` has to be awaited before the page is used'''
+
+    def __init__(self, page, proxy_uri):
+        self._page = page
+        self._proxy_uri = proxy_uri
+        parsed_proxy_uri = urlparse(self._proxy_uri)
+        self._proxy_username = parsed_proxy_uri.username
+        self._proxy_password = parsed_proxy_uri.password
+        self._blacklisted_url_patterns = []
+        self._blacklisted_resource_types = []
+        self._interception_patterns = []
+        self.url_matcher = UrlMatcher()
+        self.response_cache = None
+        self._stream_url_patterns = []
+        self._reset_stats()
+        self._session = None
+
+    async def enable(self):
+        self._session = self._page.session
+        self._session.on('Fetch.requestPaused', self._on_request_paused)
+        self._session.on('Fetch.authRequired', self._on_auth_required)
+        await self._update_interception()
+
+    async def blacklist_url_patterns(self, *args):
+        self._add_url_patterns(args)
+        await self._update_interception()
+
+    async def blacklist_url_rules(self, *rules):
+        self.url_matcher.add_rules(*rules)
+        await self._update_interception()
+
+    async def load_url_blacklist(self, path):
+        self.url_matcher.load(path)
+        await self._update_interception()
+
+    async def set_url_matcher(self, url_matcher):
+        self._blacklisted_url_patterns = []
+        self.url_matcher = url_matcher
+        await self._update_interception()
+
+    async def blacklist_resource_types(self, *args):
+        self._blacklisted_resource_types.extend(args)
+        await self._update_interception()
+
+    async def _update_interception(self):
+        command = self._interception_command()
+        if command is not None:
+            await self._session.send(command[0], **command[1])
 
-        self._session.send('Network.continueInterceptedRequest', interceptionId=interception_id)
+    def _reply(self, method, params):
+        future = asyncio.ensure_future(self._session.send(method, **params))
+        future.add_done_callback(self._on_reply_done)
@@ -1,7 +1,27 @@
+import base64
+
+from .exceptions import PageError
+
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+def decode_body(response):
+    """The bytes of a `Fetch.getResponseBody` or `Network.getResponseBody` reply."""
+    if response.get('base64Encoded'):
+        return base64.b64decode(response['body'])
+    return response['body'].encode()
+
+
 class Response:
-    def __init__(self, response_data, request, page):
+    def __init__(self, response_data, request, page, stream=None, on_stream_closed=None):
         self._response_data = response_data
         self._page = page
+        self._stream = stream
+        # Called once the stream is closed, to release the request it was taken from
+        self._on_stream_closed = on_stream_closed
+        self._consumed = False
+        self._body = None
         self.request = request
 
     @property
@@ -24,6 +44,107 @@ class Response:
     def mime_type(self):
         return self._response_data['mimeType']
 
+    @property
+    def streamed(self):
+        """Whether the body is read incrementally from Chrome, see `Page.stream_response_bodies`."""
+        return self._stream is not None
+
     def text(self):
+        if self._stream is not None:
+            return self.body().decode('utf-8', 'replace')
         response = self._page.session.send('Network.getResponseBody', requestId=self.request.request_id)
         return response.get('body')
+
+    def body(self):
+        """Get the response body. A streamed body is read whole the first time and kept for later calls.
+
+        Returns:
+            The body as bytes, decoded from base64 if Chrome sent it that way.
+        """
+        if self._stream is not None:
+            if self._body is None:
+                self._body = b''.join(self.stream())
+            return self._body
+        return decode_body(self._page.session.send('Network.getResponseBody', requestId=self.request.request_id))
+
+    def stream(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Iterate over the response body in chunks of bytes.
+
+        Only the bodies of responses matched by `Page.stream_response_bodies` are pulled from Chrome a chunk
+        at a time, with bounded memory, and they can only be streamed once, unless `body()` read them. Other
+        bodies are fetched whole first.
+
+        Args:
+            chunk_size (int, optional): The maximum number of bytes per chunk. Defaults to 64KB.
+
+        Raises:
+            PageError: If the streamed body was already read or dropped.
+        """
+        if self._stream is None or self._body is not None:
+            body = self.body()
+            for start in range(0, len(body), chunk_size):
+                yield body[start:start + chunk_size]
+            return
+
+        if self._consumed:
+            raise PageError('The body of %s was already read' % self.url)
+        self._consumed = True
+        try:
+            while True:
+                chunk = self._page.session.send('IO.read', handle=self._stream, size=chunk_size)
+                if chunk['data']:
+                    yield base64.b64decode(chunk['data']) if chunk.get('base64Encoded') else chunk['data'].encode()
+                if chunk.get('eof'):
+                    return
+        finally:
+            self._close_stream()
+
+    def close(self):
+        """Drop a streamed body that wasn't read, releasing its request. Does nothing for other responses."""
+        if self._stream is not None and not self._consumed:
+            self._consumed = True
+            self._close_stream()
+
+    def _close_stream(self):
+        if not self._page.session.closed:
+            self._page.session.send_async('IO.close', handle=self._stream)
+            # The request can only be ended once its body was read in full
+            if self._on_stream_closed is not None:
+                self._on_stream_closed()
+        self._on_stream_closed = None
+
+    def save(self, path, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Write the response body to a file, see `stream`.
+
+        Returns:
+            The number of bytes written.
+        """
+        written = 0
+        with open(path, 'wb') as f:
+            for chunk in self.stream(chunk_size):
+                f.write(chunk)
+                written += len(chunk)
+        return written
+
+
+class AsyncResponse(Response):
+    '''The asyncio counterpart to `Response`. Bodies aren't streamed from Chrome, `stream` and `save` read
+    them whole first.'''
+
+    async def text(self):
+        response = await self._page.session.send('Network.getResponseBody', requestId=self.request.request_id)
+        return response.get('body')
+
+    async def body(self):
+        return decode_body(await self._page.session.send('Network.getResponseBody', requestId=self.request.request_id))
+
+    async def stream(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        body = await self.body()
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+
+    async def save(self, path, chunk_size=DEFAULT_CHUNK_SIZE):
+        body = await self.body()
+        with open(path, 'wb') as f:
+            f.write(body)
+        return len(body)
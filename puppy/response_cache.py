@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_RESOURCE_TYPES = ('Script', 'Stylesheet', 'Font', 'Image')
+# Seconds between two evictions by the same cache
+DEFAULT_EVICTION_INTERVAL = 60
+# Threads looking up responses for `get_async`
+LOOKUP_WORKERS = 4
+
+# Response headers that aren't replayed: cookies belong to the original visit, and the stored body is the
+# decoded one, so its original encoding and length no longer apply
+_DROPPED_HEADERS = {'set-cookie', 'content-encoding', 'content-length', 'transfer-encoding'}
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    body_hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+CREATE INDEX IF NOT EXISTS entries_body_hash ON entries (body_hash);
+CREATE TABLE IF NOT EXISTS vary (
+    url TEXT PRIMARY KEY,
+    headers TEXT NOT NULL
+);
+'''
+
+
+class CachedResponse:
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class ResponseCache:
+    '''A disk-backed cache of responses, replayed to pages through request interception so static assets
+    are downloaded once per crawl instead of once per page or browser:
+
+       ```
+       cache = ResponseCache('/var/cache/puppy', max_bytes=2 * 1024 ** 3)
+       browser = Browser(response_cache=cache)
+       ```
+
+    Entries are keyed by url and by the values of the request headers named in the response's `Vary`, and
+    indexed in sqlite. Bodies are stored once per content hash. Because all of it lives in `directory`, the
+    cache survives browser restarts and can be shared by the browsers of a pool, or by several processes.
+    Entries expire after `ttl` seconds, and the least recently used ones are evicted once the bodies take
+    more than `max_bytes`. Eviction runs in the background at most every `eviction_interval` seconds, so
+    the cache can briefly exceed `max_bytes` in between.
+    '''
+
+    def __init__(self,
+                 directory,
+                 max_bytes=DEFAULT_MAX_BYTES,
+                 ttl=DEFAULT_TTL,
+                 resource_types=DEFAULT_RESOURCE_TYPES,
+                 eviction_interval=DEFAULT_EVICTION_INTERVAL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.resource_types = tuple(resource_types)
+        self.eviction_interval = eviction_interval
+        self._next_eviction = 0
+        self._bodies_dir = os.path.join(directory, 'bodies')
+        os.makedirs(self._bodies_dir, exist_ok=True)
+
+        self._db = sqlite3.connect(os.path.join(directory, 'index.sqlite'), timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(_SCHEMA)
+        self._lock = Lock()
+        # Lookups and stores touch the disk off the threads handling the page's events
+        self._readers = ThreadPoolExecutor(max_workers=LOOKUP_WORKERS)
+        self._writer = ThreadPoolExecutor(max_workers=1)
+
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._evictions = 0
+
+    def is_cacheable_request(self, request, resource_type):
+        return request.get('method', 'GET') == 'GET' and resource_type in self.resource_types
+
+    def get(self, url, request_headers):
+        """The cached response for a request, or None."""
+        with self._lock:
+            row = self._db.execute('SELECT headers FROM vary WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                self._misses += 1
+                return None
+            key = self._key(url, json.loads(row[0]), request_headers)
+            row = self._db.execute('SELECT status, headers, body_hash, created_at FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None or row[3] + self.ttl < time.time():
+                self._misses += 1
+                return None
+        status, headers, body_hash, _ = row
+        try:
+            with open(self._body_path(body_hash), 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            # Evicted, possibly by another process, since the index was read
+            with self._lock:
+                self._db.execute('DELETE FROM entries WHERE key = ? AND body_hash = ?', (key, body_hash))
+                self._db.commit()
+                self._misses += 1
+            return None
+        with self._lock:
+            self._db.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+            self._db.commit()
+            self._hits += 1
+        return CachedResponse(status, json.loads(headers), body)
+
+    def get_async(self, url, request_headers):
+        """Look up the cached response for a request in the background.
+
+        Returns:
+            A `concurrent.futures.Future` resolved with the response, or None.
+        """
+        return self._readers.submit(self.get, url, request_headers)
+
+    def put(self, url, request_headers, status, response_headers, body):
+        """Store a response in the background, if it may be cached."""
+        if not self._is_storable(status, response_headers):
+            return
+        self._writer.submit(self._store, url, request_headers, status, response_headers, body)
+
+    def stats(self):
+        with self._lock:
+            size, entries = self._db.execute(
+                'SELECT COALESCE(SUM(size), 0), (SELECT COUNT(*) FROM entries) FROM (SELECT DISTINCT body_hash, size FROM entries)'
+            ).fetchone()
+        return {
+            'hits': self._hits,
+            'misses': self._misses,
+            'stores': self._stores,
+            'evictions': self._evictions,
+            'entries': entries,
+            'bytes': size,
+        }
+
+    def close(self):
+        self._readers.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
+        self._db.close()
+
+    def _is_storable(self, status, response_headers):
+        if status != 200:
+            return False
+        headers = {h['name'].lower(): h['value'] for h in response_headers}
+        cache_control = headers.get('cache-control', '').lower()
+        return 'no-store' not in cache_control and 'private' not in cache_control and headers.get('vary', '').strip() != '*'
+
+    def _store(self, url, request_headers, status, response_headers, body):
+        vary = sorted({name.strip().lower() for h in response_headers if h['name'].lower() == 'vary'
+                       for name in h['value'].split(',') if name.strip()})
+        headers = [h for h in response_headers if h['name'].lower() not in _DROPPED_HEADERS]
+        body_hash = hashlib.sha256(body).hexdigest()
+        path = self._body_path(body_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so readers in other processes never see a partial body
+            fd, tmp_path = tempfile.mkstemp(dir=self._bodies_dir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+
+        now = time.time()
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO vary (url, headers) VALUES (?, ?)', (url, json.dumps(vary)))
+            self._db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             (self._key(url, vary, request_headers), url, status, json.dumps(headers), body_hash, len(body), now, now))
+            self._db.commit()
+            self._stores += 1
+            if time.monotonic() >= self._next_eviction:
+                self._next_eviction = time.monotonic() + self.eviction_interval
+                self._evict()
+
+    def _evict(self):
+        # Expired entries go first, then the least recently used until the bodies fit in `max_bytes`. Entries
+        # can share a body, whose size only counts once and is only freed with the last of them.
+        references = dict(self._db.execute('SELECT body_hash, COUNT(*) FROM entries GROUP BY body_hash'))
+        size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT body_hash, size FROM entries)').fetchone()[0]
+        evicted = []
+
+        def evict(key, body_hash, body_size):
+            nonlocal size
+            evicted.append((key, body_hash))
+            references[body_hash] -= 1
+            if not references[body_hash]:
+                size -= body_size
+
+        for key, body_hash, body_size in self._db.execute('SELECT key, body_hash, size FROM entries WHERE created_at < ?',
+                                                          (time.time() - self.ttl,)).fetchall():
+            evict(key, body_hash, body_size)
+        if size > self.max_bytes:
+            expired = {key for key, _ in evicted}
+            for key, body_hash, body_size in self._db.execute('SELECT key, body_hash, size FROM entries ORDER BY last_used'):
+                if size <= self.max_bytes:
+                    break
+                if key not in expired:
+                    evict(key, body_hash, body_size)
+        if not evicted:
+            return
+        self._db.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key, _ in evicted])
+        self._db.commit()
+        self._evictions += len(evicted)
+        for body_hash in {body_hash for _, body_hash in evicted}:
+            if self._db.execute('SELECT 1 FROM entries WHERE body_hash = ? LIMIT 1', (body_hash,)).fetchone() is None:
+                try:
+                    os.remove(self._body_path(body_hash))
+                except FileNotFoundError:
+                    pass
+
+    def _key(self, url, vary, request_headers):
+        request_headers = {name.lower(): value for name, value in request_headers.items()}
+        vary_values = [(name, request_headers.get(name, '')) for name in vary]
+        return hashlib.sha256(json.dumps([url, vary_values]).encode()).hexdigest()
+
+    def _body_path(self, body_hash):
+        return os.path.join(self._bodies_dir, body_hash[:2], body_hash)
@@ -0,0 +1,137 @@
+import heapq
+import itertools
+import time
+
+from collections import namedtuple
+from concurrent.futures import Future, FIRST_COMPLETED, wait
+from threading import Thread
+
+from .exceptions import BrowserError, PageError
+
+
+MapResult = namedtuple('MapResult', ['job', 'value', 'error', 'attempts'])
+MapResult.__doc__ = 'The outcome of one job run by `Browser.map`; `error` is None when the job succeeded'
+
+
+class TabScheduler:
+    '''Runs jobs across up to `concurrency` tabs of one browser, see `Browser.map`.
+
+    Jobs are pulled from their iterable only when a tab is free, so the input can be an arbitrarily long
+    generator. A job that overruns its timeout can't be interrupted, so its tab is closed instead, which
+    fails whatever command the job is blocked on, and a fresh tab takes its place.
+    '''
+
+    def __init__(self, browser, fn, concurrency=4, timeout=None, retries=2, backoff=1.0, navigate=True):
+        if concurrency < 1:
+            raise ValueError('concurrency must be at least 1, got %r' % (concurrency,))
+        self._browser = browser
+        self._fn = fn
+        self._concurrency = concurrency
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._navigate = navigate
+        self._free_pages = []
+        self._pages = []
+
+    def run(self, jobs):
+        jobs = iter(jobs)
+        exhausted = False
+        # Jobs waiting out their backoff, as (ready_at, sequence, job, attempt)
+        retries = []
+        sequence = itertools.count()
+        # future -> (job, attempt, page, deadline)
+        running = {}
+        try:
+            while True:
+                now = time.monotonic()
+                while len(running) < self._concurrency:
+                    if retries and retries[0][0] <= now:
+                        _, _, job, attempt = heapq.heappop(retries)
+                    elif not exhausted:
+                        try:
+                            job, attempt = next(jobs), 1
+                        except StopIteration:
+                            exhausted = True
+                            continue
+                    else:
+                        break
+                    page = self._take_page()
+                    deadline = None if self._timeout is None else now + self._timeout
+                    running[self._start(page, job)] = (job, attempt, page, deadline)
+
+                if not running and not retries and exhausted:
+                    return
+
+                wake_ups = [deadline for _, _, _, deadline in running.values() if deadline is not None]
+                if retries:
+                    wake_ups.append(retries[0][0])
+                wait_timeout = max(0, min(wake_ups) - now) if wake_ups else None
+                if running:
+                    done, _ = wait(list(running), timeout=wait_timeout, return_when=FIRST_COMPLETED)
+                else:
+                    time.sleep(wait_timeout)
+                    done = set()
+
+                now = time.monotonic()
+                for future in list(running):
+                    job, attempt, page, deadline = running[future]
+                    if future in done:
+                        error = future.exception()
+                        value = None if error else future.result()
+                    elif deadline is not None and now >= deadline:
+                        error, value = BrowserError('Job timed out after %s seconds' % self._timeout), None
+                        self._discard_page(page)
+                    else:
+                        continue
+                    del running[future]
+                    if future in done:
+                        self._return_page(page)
+
+                    if error is not None and isinstance(error, (BrowserError, PageError)) and attempt <= self._retries:
+                        ready_at = now + self._backoff * 2 ** (attempt - 1)
+                        heapq.heappush(retries, (ready_at, next(sequence), job, attempt + 1))
+                    else:
+                        yield MapResult(job, value, error, attempt)
+        finally:
+            for page in self._pages:
+                try:
+                    page.close()
+                except BrowserError:
+                    pass
+
+    def _start(self, page, job):
+        future = Future()
+
+        def run():
+            try:
+                if self._navigate:
+                    page.goto(job, timeout=self._timeout or 30)
+                future.set_result(self._fn(page, job))
+            except BaseException as e:
+                future.set_exception(e)
+
+        thread = Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return future
+
+    def _take_page(self):
+        if self._free_pages:
+            return self._free_pages.pop()
+        page = self._browser.new_page()
+        self._pages.append(page)
+        return page
+
+    def _return_page(self, page):
+        if page.closed:
+            self._pages.remove(page)
+        else:
+            self._free_pages.append(page)
+
+    def _discard_page(self, page):
+        self._pages.remove(page)
+        try:
+            page.close()
+        except BrowserError:
+            pass
@@ -1,77 +1,132 @@
-import json
-import queue
+import itertools
 
-from threading import Event, Thread
+from contextlib import contextmanager
 
+from .batch import Batch
 from .exceptions import BrowserError
+from .pending_commands import PendingCommands
 
 
-MESSAGE_TIMEOUT = 300
+class Subscription:
+    '''A handle to an event handler registered with `on`, used to remove it again'''
+
+    def __init__(self, emitter, method, cb):
+        self._emitter = emitter
+        self.method = method
+        self.cb = cb
+
+    def unsubscribe(self):
+        self._emitter.off(self.method, self.cb)
 
 
 class Session:
-    def __init__(self, connection, session_id):
+    def __init__(self, connection, session_id, flatten=False):
         self._connection = connection
         self._session_id = session_id
+        self._flatten = flatten
         self.closed = False
 
-        self.messages = {}
-        self.events_queue = queue.Queue()
+        self.pending = PendingCommands()
         self.event_handlers = {}
 
-        self._message_id = 0
+        self._message_ids = itertools.count()
 
-        self._handle_event_thread = Thread(target=self._handle_event_loop)
-        self._handle_event_thread.setDaemon(True)
-        self._handle_event_thread.start()
+        self._events = connection.dispatcher.register(self._handle_event)
 
     def on_message(self, message):
         if 'id' in message:
-            if 'error' in message:
-                self.messages[message['id']]['error'] = message['error']
-            else:
-                self.messages[message['id']]['result'] = message.get('result')
-            self.messages[message['id']]['event'].set()
+            self.pending.resolve(message)
         elif 'method' in message:
-            self.events_queue.put(message)
-
-    def _handle_event_loop(self):
-        while not self.closed:
-            try:
-                event = self.events_queue.get(timeout=1)
-            except queue.Empty:
-                continue
-
-            if event['method'] in self.event_handlers:
-                for cb in self.event_handlers[event['method']]:
-                    cb(**event['params'])
-
-            self.events_queue.task_done()
-
-    def send(self, method, **kwargs):
+            self._events.put(message)
+
+    def _handle_event(self, event):
+        if 'callback' in event:
+            event['callback']()
+            return
+        for cb in list(self.event_handlers.get(event['method'], ())):
+            cb(**event['params'])
+
+    def post(self, cb, *args):
+        """Call `cb(*args)` on the thread handling this session's events, in order with them. Meant for
+        callbacks of futures, which otherwise run on the connection's receiving thread."""
+        self._events.put({'method': None, 'callback': lambda: cb(*args)})
+
+    def send(self, method, _timeout=None, **kwargs):
+        return self.wait(self.send_async(method, _timeout=_timeout, **kwargs))
+
+    def send_async(self, method, _timeout=None, **kwargs):
+        """Send a command without waiting for its reply.
+
+        Args:
+            method (str): The devtools protocol method to call.
+            _timeout (float, optional): Seconds before the command expires. Defaults to `MESSAGE_TIMEOUT`.
+            **kwargs: The method's parameters.
+
+        Returns:
+            A `concurrent.futures.Future` resolved with the command's result, or with a BrowserError if the
+            browser answered with an error, the command expired or the session was closed.
+        """
+        if self.closed:
+            raise BrowserError('Session %s is closed' % self._session_id)
         message = {'method': method, 'params': kwargs}
         id_ = self.message_id()
         message['id'] = id_
-        event_ = Event()
-        self.messages[id_] = {'event': event_}
-        self._connection.send('Target.sendMessageToTarget',
-                              message=json.dumps(message),
-                              sessionId=self._session_id)
-        if not event_.wait(timeout=MESSAGE_TIMEOUT):
-            raise BrowserError('Timed out waiting for response from browser')
-        if 'error' in self.messages[id_]:
-            raise BrowserError(self.messages[id_]['error'])
+        future = self.pending.add(id_, _timeout)
+        if self._flatten:
+            message['sessionId'] = self._session_id
+            self._connection._send_no_wait(message)
         else:
-            return self.messages[id_]['result']
+            wrapper = self._connection.send_async('Target.sendMessageToTarget',
+                                                  message=self._connection.codec.dumps(message),
+                                                  sessionId=self._session_id)
+            wrapper.add_done_callback(lambda wrapper: self._on_wrapper_done(wrapper, id_))
+        return future
+
+    def _on_wrapper_done(self, wrapper, id_):
+        # The wrapped message never reached the target, so no reply will come for it
+        if wrapper.exception() is not None:
+            self.pending.fail(id_, wrapper.exception())
+
+    @contextmanager
+    def batch(self):
+        """Pipeline several commands; see `puppy.batch.Batch`."""
+        batch = Batch(self)
+        yield batch
+        batch.wait()
+
+    def wait(self, future):
+        return self.pending.wait(future)
 
     def on(self, method, cb):
+        """Call `cb` with the params of every `method` event this session receives.
+
+        Returns:
+            A Subscription whose `unsubscribe()` removes the handler.
+        """
         self.event_handlers[method] = self.event_handlers.get(method, [])
         self.event_handlers[method].append(cb)
+        self._connection._subscribe(method)
+        return Subscription(self, method, cb)
+
+    def off(self, method, cb):
+        """Remove a handler registered with `on`."""
+        handlers = self.event_handlers.get(method, [])
+        if cb in handlers:
+            handlers.remove(cb)
+            if not self.closed:
+                self._connection._unsubscribe(method)
 
     def message_id(self):
-        id_ = self._message_id
-        self._message_id += 1
-        return id_
+        return next(self._message_ids)
 
     def close(self):
+        """Stop handling events and fail every command still waiting on a reply."""
+        if self.closed:
+            return
         self.closed = True
+        self._events.close()
+        self._connection._sessions.pop(self._session_id, None)
+        for method, handlers in self.event_handlers.items():
+            for _ in handlers:
+                self._connection._unsubscribe(method)
+        self.pending.cancel_all(BrowserError('Session %s is closed' % self._session_id))
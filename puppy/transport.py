@@ -0,0 +1,121 @@
+import os
+import subprocess
+
+from threading import Lock
+
+import websocket
+from websocket._exceptions import WebSocketConnectionClosedException
+
+from .exceptions import ConnectionClosedError
+
+
+class WebSocketTransport:
+    '''Exchanges devtools messages over the browser's websocket endpoint'''
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self._ws = websocket.create_connection(endpoint, enable_multithread=True)
+
+    def send(self, message_raw):
+        try:
+            self._ws.send(message_raw)
+        except (WebSocketConnectionClosedException, OSError):
+            raise ConnectionClosedError('Connection to browser closed')
+
+    def recv(self):
+        try:
+            return self._ws.recv()
+        except (WebSocketConnectionClosedException, OSError):
+            raise ConnectionClosedError('Connection to browser closed')
+
+    def close(self):
+        # Don't wait for the browser to acknowledge; the receiving thread may be blocked on the socket
+        self._ws.close(timeout=0)
+
+
+class PipeTransport:
+    '''Exchanges devtools messages with a browser launched with `--remote-debugging-pipe`. Chrome reads
+    commands from its file descriptor 3 and writes replies and events to its file descriptor 4, every
+    message being a JSON document followed by a NUL byte. There is no framing, masking or port involved.
+    '''
+
+    # Chrome reads and writes this much at a time
+    READ_SIZE = 256 * 1024
+
+    # Runs the browser with the pipes it's given as stdin and stdout moved to fds 3 and 4. Letting the shell
+    # do it keeps `preexec_fn`, which isn't safe with threads running, out of the launch; and because every
+    # other descriptor is closed, the browser only ever holds its own two pipe ends.
+    _LAUNCHER = ['/bin/sh', '-c', 'exec "$0" "$@" 3<&0 4>&1 0</dev/null 1>/dev/null']
+
+    def __init__(self, write_fd, read_fd):
+        self.endpoint = None
+        self._write_fd = write_fd
+        self._read_fd = read_fd
+        self._buffer = bytearray()
+        self._write_lock = Lock()
+        self.closed = False
+
+    @classmethod
+    def launch(cls, cmd, stderr=subprocess.DEVNULL):
+        """Launch a browser with `--remote-debugging-pipe` in `cmd`, connected to a new transport.
+
+        Returns:
+            The transport and the browser's `subprocess.Popen`.
+        """
+        command_read, command_write = os.pipe()
+        reply_read, reply_write = os.pipe()
+        try:
+            process = subprocess.Popen(cls._LAUNCHER + list(cmd),
+                                       stdin=command_read,
+                                       stdout=reply_write,
+                                       stderr=stderr,
+                                       close_fds=True)
+        except BaseException:
+            os.close(command_write)
+            os.close(reply_read)
+            raise
+        finally:
+            # The browser has its own copies; keeping these would hide its exit from the reader
+            os.close(command_read)
+            os.close(reply_write)
+        return cls(command_write, reply_read), process
+
+    def send(self, message_raw):
+        data = message_raw.encode() + b'\0'
+        with self._write_lock:
+            if self.closed:
+                raise ConnectionClosedError('Connection to browser closed')
+            try:
+                while data:
+                    data = data[os.write(self._write_fd, data):]
+            except OSError:
+                raise ConnectionClosedError('Connection to browser closed')
+
+    def recv(self):
+        start = 0
+        while True:
+            end = self._buffer.find(b'\0', start)
+            if end >= 0:
+                message_raw = self._buffer[:end].decode()
+                del self._buffer[:end + 1]
+                return message_raw
+            start = len(self._buffer)
+            try:
+                chunk = os.read(self._read_fd, self.READ_SIZE)
+            except OSError:
+                chunk = b''
+            if not chunk:
+                # Only the reading thread may close its end, it could otherwise be reused while being read
+                if self._read_fd is not None:
+                    os.close(self._read_fd)
+                    self._read_fd = None
+                raise ConnectionClosedError('Connection to browser closed')
+            self._buffer += chunk
+
+    def close(self):
+        """Close the command pipe. The reply pipe is closed once the browser closes its end."""
+        with self._write_lock:
+            if self.closed:
+                return
+            self.closed = True
+            os.close(self._write_fd)
@@ -0,0 +1,322 @@
+import re
+
+from collections import Counter, deque
+from threading import Lock
+from urllib.parse import urlparse
+
+
+# Adblock `$` options naming resource types, mapped to the devtools resource types they cover
+RESOURCE_TYPE_OPTIONS = {
+    'document': 'Document',
+    'subdocument': 'Document',
+    'stylesheet': 'Stylesheet',
+    'image': 'Image',
+    'media': 'Media',
+    'font': 'Font',
+    'script': 'Script',
+    'xmlhttprequest': 'XHR',
+    'fetch': 'Fetch',
+    'websocket': 'WebSocket',
+    'ping': 'Ping',
+    'other': 'Other',
+}
+
+_PURE_DOMAIN_RULE_RE = re.compile(r'^\|\|([a-z0-9.-]+)\^?$')
+_LITERAL_RE = re.compile(r'[^*^|]+')
+# `/regex/`, optionally followed by `$options`
+_REGEX_RULE_RE = re.compile(r'^/(.+)/(?:\$([^/]*))?$')
+
+
+class SubstringAutomaton:
+    '''An Aho-Corasick automaton finding every key contained in a string in a single pass over it.
+
+    Keys are added to the trie as they come; the failure links are only recomputed, all at once, the next
+    time the automaton is searched. Searches use the tables of the last build, which are replaced as a whole
+    and never modified, so an automaton can be searched from several threads while keys are added.
+    '''
+
+    def __init__(self):
+        self._goto = [{}]
+        self._keys = [()]
+        # (goto, fail, outputs) as of the last build
+        self._tables = ([{}], [0], [()])
+        self._dirty = False
+        self._lock = Lock()
+
+    def __len__(self):
+        return sum(len(keys) for keys in self._keys)
+
+    def add(self, key):
+        with self._lock:
+            node = 0
+            for char in key:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._keys.append(())
+                node = next_node
+            if key not in self._keys[node]:
+                self._keys[node] += (key,)
+            self._dirty = True
+
+    def _build(self):
+        # Breadth first, so a node's failure link is final before its children's are computed
+        goto = [dict(transitions) for transitions in self._goto]
+        fail = [0] * len(goto)
+        outputs = list(self._keys)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, next_node in goto[node].items():
+                link = fail[node]
+                while link and char not in goto[link]:
+                    link = fail[link]
+                link = goto[link].get(char, 0)
+                fail[next_node] = link if link != next_node else 0
+                outputs[next_node] = outputs[next_node] + outputs[fail[next_node]]
+                queue.append(next_node)
+        self._tables = (goto, fail, outputs)
+        self._dirty = False
+
+    def search(self, text):
+        """Yield the keys found in `text`, in the order their matches end."""
+        if self._dirty:
+            with self._lock:
+                if self._dirty:
+                    self._build()
+        goto, fail, outputs = self._tables
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if outputs[node]:
+                for key in outputs[node]:
+                    yield key
+
+
+class DomainTrie:
+    '''Matches hosts against domains, a domain covering all of its subdomains'''
+
+    _END = ''
+
+    def __init__(self):
+        self._root = {}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, domain):
+        node = self._root
+        for label in reversed(domain.lower().strip('.').split('.')):
+            node = node.setdefault(label, {})
+        if self._END not in node:
+            self._size += 1
+            node[self._END] = domain
+
+    def match(self, host):
+        """The domain covering `host`, or None."""
+        node = self._root
+        for label in reversed(host.lower().split('.')):
+            node = node.get(label)
+            if node is None:
+                return None
+            if self._END in node:
+                return node[self._END]
+        return None
+
+
+class _Rules:
+    # One direction of a matcher: the blocking rules, or the `@@` exceptions to them
+
+    def __init__(self):
+        # Substrings added as such, matched case sensitively like the Fetch patterns they may be pushed as
+        self.exact = SubstringAutomaton()
+        # The literal parts of adblock rules, matched against the lowercased url
+        self.substrings = SubstringAutomaton()
+        # The keys of `substrings` that are rules on their own, rather than keys of `keyed` rules
+        self.plain = set()
+        self.domains = DomainTrie()
+        # literal key -> [(rule, regex, resource types)], checked when the key occurs in the url
+        self.keyed = {}
+        # Rules without any literal part, checked against every url
+        self.unkeyed = []
+
+    def __len__(self):
+        return (len(self.exact) + len(self.plain) + len(self.domains) + sum(len(rules) for rules in self.keyed.values())
+                + len(self.unkeyed))
+
+    def add_substring(self, substring):
+        self.substrings.add(substring)
+        self.plain.add(substring)
+
+    def match(self, url, lowered_url, host, resource_type):
+        key = next(self.exact.search(url), None)
+        if key is not None:
+            return key
+        url = lowered_url
+        for key in self.substrings.search(url):
+            if key in self.plain:
+                return key
+            for rule, regex, resource_types in self.keyed[key]:
+                if (resource_types is None or resource_type in resource_types) and regex.search(url):
+                    return rule
+        if host:
+            domain = self.domains.match(host)
+            if domain is not None:
+                return '||{}^'.format(domain)
+        for rule, regex, resource_types in self.unkeyed:
+            if (resource_types is None or resource_type in resource_types) and regex.search(url):
+                return rule
+        return None
+
+
+class UrlMatcher:
+    '''Decides whether a url is blacklisted, in time independent of the number of rules:
+
+       ```
+       matcher = UrlMatcher()
+       matcher.add_substrings('doubleclick', '/ads/')
+       matcher.add_domains('tracker.example')
+       matcher.load('easylist.txt')
+       matcher.match('https://cdn.tracker.example/t.js', 'Script')  # '||tracker.example^'
+       ```
+
+    Plain substrings are found with one Aho-Corasick pass over the url, domains are looked up in a trie of
+    their labels, and adblock rules are compiled to regular expressions that are only tried when their
+    longest literal part occurs in the url. Substrings are case sensitive, like the Fetch patterns they can be
+    pushed to Chrome as; domains and adblock rules are not. Every match is counted in `hits`, exceptions
+    under their `@@` rule.
+    '''
+
+    def __init__(self):
+        self.hits = Counter()
+        self.unsupported = 0
+        self._block = _Rules()
+        self._allow = _Rules()
+        self._substrings_only = True
+
+    def __len__(self):
+        return len(self._block) + len(self._allow)
+
+    @property
+    def substrings_only(self):
+        """Whether every rule is a plain substring, i.e. can be expressed as a Fetch url pattern."""
+        return self._substrings_only
+
+    def add_substrings(self, *substrings):
+        for substring in substrings:
+            self._block.exact.add(substring)
+
+    def add_domains(self, *domains):
+        for domain in domains:
+            self._block.domains.add(domain)
+        self._substrings_only = self._substrings_only and not domains
+
+    def add_rules(self, *rules):
+        """Add adblock filter rules, e.g. `||ads.example.com^`, `/banner/*/img^` or `@@||example.com/ads.js`.
+
+        Comments, element hiding rules and rules with options other than resource types (such as
+        `$third-party` or `$domain=`) are skipped and counted in `unsupported`.
+        """
+        for rule in rules:
+            rule = rule.strip()
+            if not rule or rule.startswith(('!', '[')) or '##' in rule or '#@#' in rule or '#?#' in rule:
+                continue
+            self._add_rule(rule)
+
+    def load(self, path):
+        """Add the adblock filter rules in a file, one per line."""
+        with open(path) as f:
+            self.add_rules(*f)
+
+    def match(self, url, resource_type=None):
+        """The rule blacklisting `url`, or None if no rule does or an exception rule allows it."""
+        lowered_url = url.lower()
+        host = urlparse(lowered_url).hostname if (len(self._block.domains) or len(self._allow.domains)) else None
+        rule = self._block.match(url, lowered_url, host, resource_type)
+        if rule is None:
+            return None
+        exception = self._allow.match(url, lowered_url, host, resource_type)
+        if exception is not None:
+            self.hits['@@' + exception] += 1
+            return None
+        self.hits[rule] += 1
+        return rule
+
+    def _add_rule(self, rule):
+        # Exception rules are stored without their `@@`, which `match` adds back when counting their hits
+        if rule.startswith('@@'):
+            rules, rule = self._allow, rule[2:]
+        else:
+            rules = self._block
+        regex_match = _REGEX_RULE_RE.match(rule)
+        if regex_match:
+            pattern, options = regex_match.groups()
+        elif '$' in rule:
+            pattern, _, options = rule.rpartition('$')
+        else:
+            pattern, options = rule, None
+        resource_types = None
+        if options is not None:
+            resource_types = self._parse_options(options)
+            if resource_types is False:
+                self.unsupported += 1
+                return
+        self._substrings_only = False
+
+        if regex_match:
+            # A regular expression rule; there's no literal to key it on. It's compiled from the rule as written,
+            # since lowercasing it would change escapes such as `\W` or `\D`
+            try:
+                rules.unkeyed.append((rule, re.compile(pattern, re.IGNORECASE), resource_types))
+            except re.error:
+                self.unsupported += 1
+            return
+
+        pattern = pattern.lower()
+
+        domain_match = _PURE_DOMAIN_RULE_RE.match(pattern)
+        if domain_match and resource_types is None:
+            rules.domains.add(domain_match.group(1))
+            return
+
+        if resource_types is None and not any(c in pattern for c in '*^|'):
+            rules.add_substring(pattern)
+            return
+
+        regex = re.compile(self._to_regex(pattern))
+        literals = _LITERAL_RE.findall(pattern.lstrip('|'))
+        if not literals:
+            rules.unkeyed.append((rule, regex, resource_types))
+            return
+        key = max(literals, key=len)
+        rules.substrings.add(key)
+        rules.keyed.setdefault(key, []).append((rule, regex, resource_types))
+
+    def _parse_options(self, options):
+        # The resource types a rule applies to, None for all of them, or False if it has other options
+        included, excluded = set(), set()
+        for option in options.lower().split(','):
+            negated = option.startswith('~')
+            resource_type = RESOURCE_TYPE_OPTIONS.get(option.lstrip('~'))
+            if resource_type is None:
+                return False
+            (excluded if negated else included).add(resource_type)
+        if not included:
+            included = set(RESOURCE_TYPE_OPTIONS.values())
+        return included - excluded
+
+    def _to_regex(self, pattern):
+        prefix, suffix = '', ''
+        if pattern.startswith('||'):
+            prefix, pattern = r'^[a-z][a-z0-9+.-]*://(?:[^/?#]*\.)?', pattern[2:]
+        elif pattern.startswith('|'):
+            prefix, pattern = '^', pattern[1:]
+        if pattern.endswith('|'):
+            suffix, pattern = '$', pattern[:-1]
+        body = re.escape(pattern).replace(r'\*', '.*').replace(r'\^', r'(?:[^\w\-.%]|$)')
+        return prefix + body + suffix
@@ -0,0 +1,79 @@
+import os
+import sys
+import tempfile
+import textwrap
+import unittest
+
+from puppy.connection import Connection
+from puppy.transport import PipeTransport
+
+
+# Answers every command like a browser speaking CDP over fds 3 and 4, and exits when fd 3 is closed
+FAKE_BROWSER = textwrap.dedent('''
+    import json
+    import os
+
+    buffer = b''
+    while True:
+        chunk = os.read(3, 65536)
+        if not chunk:
+            break
+        buffer += chunk
+        while b'\\0' in buffer:
+            message_raw, buffer = buffer.split(b'\\0', 1)
+            message = json.loads(message_raw)
+            if message['method'] == 'Fake.openFds':
+                result = {'fds': sorted(int(fd) for fd in os.listdir('/proc/self/fd'))}
+            else:
+                result = {'echo': message['params']}
+            os.write(4, json.dumps({'id': message['id'], 'result': result}).encode() + b'\\0')
+''')
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'needs /proc and /bin/sh')
+class PipeTransportTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.script = tempfile.mkstemp(suffix='.py')
+        with os.fdopen(fd, 'w') as f:
+            f.write(FAKE_BROWSER)
+        self.processes = []
+
+    def tearDown(self):
+        for process in self.processes:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+        os.remove(self.script)
+
+    def launch(self):
+        transport, process = PipeTransport.launch([sys.executable, self.script, '--remote-debugging-pipe'])
+        self.processes.append(process)
+        return Connection(transport=transport), process
+
+    def test_exchanges_messages(self):
+        connection, _ = self.launch()
+        try:
+            self.assertEqual(connection.send('Fake.echo', text='x' * 300000), {'echo': {'text': 'x' * 300000}})
+        finally:
+            connection.close()
+
+    def test_browser_only_holds_its_own_pipe_ends(self):
+        connections = [self.launch()[0] for _ in range(3)]
+        try:
+            for connection in connections:
+                # The listing itself opens one more descriptor
+                self.assertEqual(connection.send('Fake.openFds')['fds'][:5], [0, 1, 2, 3, 4])
+                self.assertEqual(len(connection.send('Fake.openFds')['fds']), 6)
+        finally:
+            for connection in connections:
+                connection.close()
+
+    def test_browser_sees_eof_when_the_transport_closes(self):
+        connection, process = self.launch()
+        connection.send('Fake.echo')
+        connection.close()
+        self.assertEqual(process.wait(timeout=5), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import tempfile
+import unittest
+
+from puppy.url_matcher import DomainTrie, SubstringAutomaton, UrlMatcher
+
+
+class SubstringAutomatonTest(unittest.TestCase):
+
+    def test_finds_every_key_in_one_pass(self):
+        automaton = SubstringAutomaton()
+        for key in ('he', 'she', 'his', 'hers'):
+            automaton.add(key)
+        self.assertEqual(list(automaton.search('ushers')), ['she', 'he', 'hers'])
+        self.assertEqual(list(automaton.search('nothing')), [])
+
+    def test_keys_added_after_a_search_are_found(self):
+        automaton = SubstringAutomaton()
+        automaton.add('ads')
+        self.assertEqual(list(automaton.search('/banner/x')), [])
+        automaton.add('banner')
+        self.assertEqual(list(automaton.search('/banner/ads')), ['banner', 'ads'])
+        self.assertEqual(len(automaton), 2)
+
+    def test_duplicate_keys_are_stored_once(self):
+        automaton = SubstringAutomaton()
+        automaton.add('ads')
+        automaton.add('ads')
+        self.assertEqual(len(automaton), 1)
+        self.assertEqual(list(automaton.search('ads')), ['ads'])
+
+
+class DomainTrieTest(unittest.TestCase):
+
+    def test_domains_cover_their_subdomains(self):
+        trie = DomainTrie()
+        trie.add('tracker.example')
+        self.assertEqual(trie.match('tracker.example'), 'tracker.example')
+        self.assertEqual(trie.match('cdn.TRACKER.example'), 'tracker.example')
+        self.assertIsNone(trie.match('nottracker.example'))
+        self.assertIsNone(trie.match('example'))
+
+    def test_the_shortest_covering_domain_wins(self):
+        trie = DomainTrie()
+        trie.add('a.example')
+        trie.add('b.a.example')
+        self.assertEqual(trie.match('c.b.a.example'), 'a.example')
+        self.assertEqual(len(trie), 2)
+
+
+class UrlMatcherTest(unittest.TestCase):
+
+    def test_substrings_are_case_sensitive(self):
+        matcher = UrlMatcher()
+        matcher.add_substrings('/Ads/')
+        self.assertEqual(matcher.match('https://example.com/Ads/x.js'), '/Ads/')
+        self.assertIsNone(matcher.match('https://example.com/ads/x.js'))
+        self.assertTrue(matcher.substrings_only)
+
+    def test_domain_rules(self):
+        matcher = UrlMatcher()
+        matcher.add_rules('||tracker.example^')
+        self.assertEqual(matcher.match('https://cdn.tracker.example/t.js'), '||tracker.example^')
+        self.assertIsNone(matcher.match('https://example.com/?ref=tracker.example'))
+        self.assertFalse(matcher.substrings_only)
+
+    def test_wildcard_and_separator_rules(self):
+        matcher = UrlMatcher()
+        matcher.add_rules('/banner/*/img^')
+        self.assertEqual(matcher.match('https://example.com/banner/big/img?x=1'), '/banner/*/img^')
+        self.assertIsNone(matcher.match('https://example.com/banner/big/imgs'))
+
+    def test_resource_type_options(self):
+        matcher = UrlMatcher()
+        matcher.add_rules('/adserver/*$script', '||cdn.example^$~image')
+        self.assertEqual(matcher.match('https://example.com/adserver/x.js', 'Script'), '/adserver/*$script')
+        self.assertIsNone(matcher.match('https://example.com/adserver/x.png', 'Image'))
+        self.assertEqual(matcher.match('https://cdn.example/x.css', 'Stylesheet'), '||cdn.example^$~image')
+        self.assertIsNone(matcher.match('https://cdn.example/x.png', 'Image'))
+
+    def test_unsupported_options_are_skipped(self):
+        matcher = UrlMatcher()
+        matcher.add_rules('||ads.example^$third-party', '/ads/*$domain=example.com', 'example.com##.ad')
+        self.assertEqual(matcher.unsupported, 2)
+        self.assertEqual(len(matcher), 0)
+        self.assertIsNone(matcher.match('https://ads.example/x.js'))
+
+    def test_regex_rules_keep_their_case_sensitive_escapes(self):
+        matcher = UrlMatcher()
+        matcher.add_rules(r'/\Wads\W/', r'/track\D+\.js/$script')
+        self.assertEqual(matcher.match('https://example.com/ads/x.js'), r'/\Wads\W/')
+        self.assertEqual(matcher.match('https://example.com/ADS/x.js'), r'/\Wads\W/')
+        self.assertIsNone(matcher.match('https://example.com/loads.js'))
+        self.assertEqual(matcher.match('https://example.com/Tracker.js', 'Script'), r'/track\D+\.js/$script')
+        self.assertIsNone(matcher.match('https://example.com/track1.js', 'Script'))
+        self.assertIsNone(matcher.match('https://example.com/tracker.js', 'Image'))
+
+    def test_invalid_regex_rules_are_skipped(self):
+        matcher = UrlMatcher()
+        matcher.add_rules('/ads(/')
+        self.assertEqual(matcher.unsupported, 1)
+
+    def test_exceptions_allow_blocked_urls(self):
+        matcher = UrlMatcher()
+        matcher.add_rules('||ads.example^', '@@||ads.example/allowed.js', '@@/safe/$image')
+        self.assertEqual(matcher.match('https://ads.example/x.js'), '||ads.example^')
+        self.assertIsNone(matcher.match('https://ads.example/allowed.js'))
+        self.assertIsNone(matcher.match('https://ads.example/safe/x.png', 'Image'))
+        self.assertEqual(matcher.match('https://ads.example/safe/x.js', 'Script'), '||ads.example^')
+
+    def test_hits_count_rules_and_exceptions(self):
+        matcher = UrlMatcher()
+        matcher.add_rules('||ads.example^', '@@||ads.example/allowed.js')
+        matcher.match('https://ads.example/x.js')
+        matcher.match('https://ads.example/y.js')
+        matcher.match('https://ads.example/allowed.js')
+        matcher.match('https://example.com/')
+        self.assertEqual(matcher.hits, {'||ads.example^': 2, '@@||ads.example/allowed.js': 1})
+
+    def test_load_reads_rules_from_a_file(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt') as f:
+            f.write('! comment\n[Adblock Plus 2.0]\n||ads.example^\n\n/banner/\n')
+            f.flush()
+            matcher = UrlMatcher()
+            matcher.load(f.name)
+        self.assertEqual(len(matcher), 2)
+        self.assertEqual(matcher.match('https://example.com/banner/x'), '/banner/')